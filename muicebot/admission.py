@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from nonebot import logger
+
+from .llm import ModelConfig
+
+
+class AdmissionRejected(Exception):
+    """
+    请求因排队已满或等待超时而被拒绝
+    """
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish: float
+    seq: int
+    start: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class _Lane:
+    """
+    单个模型提供者的准入通道：并发上限、令牌桶限速与按会话的加权公平队列
+    """
+
+    def __init__(self) -> None:
+        self.concurrency = 0
+        """最大并发数，0 表示不限制"""
+        self.rate = 0.0
+        """令牌补充速率（个/秒），0 表示不限速"""
+        self.burst = 1
+        """令牌桶容量"""
+
+        self.in_flight = 0
+        self.tokens = float("inf")
+        self.updated = time.monotonic()
+        self.vtime = 0.0
+        """虚拟时间（最近一次放行请求的虚拟开始时间）"""
+        self.finish: dict[str, float] = {}
+        """会话 -> 该会话最后一个排队请求的虚拟完成时间"""
+        self.heap: list[_Waiter] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+        self.wait_avg = 0.0
+        """排队等待时间的指数加权平均（秒）"""
+        self.wait_max = 0.0
+        """最长排队等待时间（秒）"""
+        self.rejected = 0
+        """被拒绝的请求数"""
+
+    def configure(self, concurrency: int, rpm: int, burst: int):
+        self.concurrency = max(concurrency, 0)
+        self.rate = max(rpm, 0) / 60
+        self.burst = max(burst, 1)
+        self.tokens = min(self.tokens, self.burst)
+
+    @property
+    def queued(self) -> int:
+        return sum(not waiter.future.done() for waiter in self.heap)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take_token(self) -> bool:
+        if not self.rate:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def token_delay(self) -> float:
+        return max((1 - self.tokens) / self.rate, 0.001)
+
+
+class AdmissionController:
+    """
+    模型调用准入控制
+
+    每个模型提供者一个通道：超过并发上限或速率限制的请求进入队列，队列按会话进行加权公平调度
+    （同一会话的连续请求依次排在后面，不会挤占其他会话）；队列已满或等待超时的请求被拒绝
+    """
+
+    def __init__(self, max_queue: int, queue_timeout: float) -> None:
+        self.max_queue = max_queue
+        """每个通道的最大排队请求数，0 表示不限制"""
+        self.queue_timeout = queue_timeout
+        """最长排队时间（秒），0 表示不限制"""
+
+        self._lanes: dict[str, _Lane] = {}
+        self._seq = itertools.count()
+
+    @staticmethod
+    def lane_key(config: ModelConfig) -> str:
+        return f"{config.provider}:{config.model_name}:{config.api_host}"
+
+    def _dispatch(self, lane: _Lane):
+        """
+        按虚拟完成时间依次放行排队的请求，直到达到并发上限或令牌耗尽
+        """
+        while lane.heap:
+            waiter = lane.heap[0]
+            if waiter.future.done():  # 已取消或超时
+                heapq.heappop(lane.heap)
+                continue
+
+            if lane.concurrency and lane.in_flight >= lane.concurrency:
+                return
+
+            if not lane.take_token():
+                if lane.timer is None:
+                    lane.timer = asyncio.get_running_loop().call_later(lane.token_delay(), self._on_timer, lane)
+                return
+
+            heapq.heappop(lane.heap)
+            lane.vtime = waiter.start
+            lane.in_flight += 1
+            waiter.future.set_result(None)
+
+        # 队列清空后，虚拟完成时间已过去的会话无需继续记录
+        if len(lane.finish) > 1024:
+            lane.finish = {key: finish for key, finish in lane.finish.items() if finish > lane.vtime}
+
+    def _on_timer(self, lane: _Lane):
+        lane.timer = None
+        self._dispatch(lane)
+
+    def _release(self, lane: _Lane):
+        lane.in_flight -= 1
+        self._dispatch(lane)
+
+    @asynccontextmanager
+    async def slot(self, config: ModelConfig, session: str, weight: float = 1.0) -> AsyncIterator[None]:
+        """
+        获取一次模型调用的准入许可，退出上下文时释放
+
+        :param config: 模型配置（读取 `max_concurrency`、`rate_limit_rpm`、`rate_limit_burst`）
+        :param session: 会话标识，公平调度以会话为单位
+        :param weight: 会话权重，权重越大分得的份额越多
+
+        :raise AdmissionRejected: 排队已满或等待超时
+        """
+        lane = self._lanes.setdefault(self.lane_key(config), _Lane())
+        lane.configure(config.max_concurrency, config.rate_limit_rpm, config.rate_limit_burst)
+
+        if self.max_queue and lane.queued >= self.max_queue:
+            lane.rejected += 1
+            raise AdmissionRejected(f"排队请求已达上限 ({self.max_queue})")
+
+        start = max(lane.vtime, lane.finish.get(session, 0.0))
+        finish = start + 1 / max(weight, 1e-3)
+        lane.finish[session] = finish
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.heap, _Waiter(finish, next(self._seq), start, future))
+        enqueued = time.monotonic()
+        self._dispatch(lane)
+
+        if not future.done():
+            logger.info(f"模型调用排队中: 会话 {session}，当前队列深度 {lane.queued}，正在执行 {lane.in_flight}")
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout or None)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    self._release(lane)  # 放弃时恰好获得许可
+                else:
+                    future.cancel()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                lane.rejected += 1
+                raise AdmissionRejected(f"排队超时 ({self.queue_timeout}s)") from None
+
+            waited = time.monotonic() - enqueued
+            lane.wait_avg = 0.2 * waited + 0.8 * lane.wait_avg
+            lane.wait_max = max(lane.wait_max, waited)
+            logger.info(f"模型调用排队 {waited:.2f}s 后开始执行 (剩余队列深度 {lane.queued})")
+
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        获取各通道的队列深度、正在执行的请求数与排队等待时间
+        """
+        return {
+            key: {
+                "queued": lane.queued,
+                "in_flight": lane.in_flight,
+                "wait_avg": lane.wait_avg,
+                "wait_max": lane.wait_max,
+                "rejected": lane.rejected,
+            }
+            for key, lane in self._lanes.items()
+        }
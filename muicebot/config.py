@@ -45,6 +45,64 @@ class PluginConfig(BaseModel):
     """针对 Deepseek-R1 等思考模型的思考过程提取模式"""
     enable_embedding_cache: bool = True
     """启用嵌入缓存"""
+    embedding_memory_cache_size: int = 64
+    """每个嵌入模型的内存嵌入缓存上限（MB），0 表示仅使用磁盘缓存"""
+    enable_write_behind: bool = False
+    """启用消息延迟批量写入（多条消息合并为一次事务落库，适用于高并发群聊）"""
+    write_behind_max_latency: float = 1.0
+    """延迟写入的最大刷新延迟（秒）"""
+    write_behind_batch_size: int = 64
+    """延迟写入的单批最大消息条数，达到后立即刷新"""
+    usage_flush_interval: float = 5.0
+    """用量统计写入数据库的间隔（秒）"""
+    enable_history_summary: bool = False
+    """启用对话历史摘要（仅私聊）：历史超过阈值后，由模型在后台将较早的对话压缩为摘要并作为系统提示注入"""
+    history_summary_threshold: int = 20
+    """触发摘要的历史轮数阈值"""
+    history_summary_keep: int = 6
+    """生成摘要时保留的最近原始对话轮数"""
+    enable_long_term_memory: bool = False
+    """启用长期记忆（仅私聊）：对保存的对话计算嵌入并建立索引，调用模型时检索语义相关的历史对话作为系统提示注入"""
+    long_term_memory_embedding: Optional[str] = None
+    """长期记忆使用的嵌入模型配置名，为空时使用默认嵌入模型"""
+    long_term_memory_top_k: int = 3
+    """每次检索注入的最大历史对话数"""
+    long_term_memory_min_score: float = 0.5
+    """注入的历史对话与当前消息的最低相似度"""
+    http_max_connections: int = 100
+    """文件下载共享连接池的最大连接数"""
+    http_max_connections_per_host: int = 8
+    """文件下载时对同一主机的最大并发请求数"""
+    http_keepalive_expiry: float = 30.0
+    """空闲长连接的保持时间（秒）"""
+    http_enable_http2: bool = True
+    """启用 HTTP/2（需要安装 `h2`）"""
+    max_download_size: int = 100
+    """单个文件的最大下载大小（MB），0 表示不限制"""
+    download_retries: int = 2
+    """文件下载中断时的重试次数（支持断点续传）"""
+    enable_media_store: bool = False
+    """启用多模态文件内容寻址存储（按来源与内容哈希去重，跳过重复下载）"""
+    media_gc_grace_hours: int = 24
+    """不再被任何可用对话引用的文件在被回收前的保留时间（小时）"""
+    base64_cache_size: int = 256
+    """多模态文件 Base64 编码结果的内存缓存上限（MB），0 表示禁用缓存"""
+    enable_base64_disk_cache: bool = False
+    """将 Base64 编码结果同时写入磁盘缓存，重启后或内存缓存淘汰后无需重新编码"""
+    base64_disk_cache_size: int = 1024
+    """Base64 磁盘缓存的容量上限（MB），超出时删除最久未使用的文件"""
+    image_workers: int = 4
+    """图片预处理（缩放与重新编码）的最大并行线程数"""
+    completion_cache_size: int = 1024
+    """模型回复缓存的最大条目数（需在模型配置中启用 `enable_completion_cache`）"""
+    admission_max_queue: int = 32
+    """每个模型提供者的最大排队请求数，超出时直接回复繁忙提示，0 表示不限制"""
+    admission_queue_timeout: float = 60.0
+    """模型调用的最长排队时间（秒），超时后回复繁忙提示，0 表示不限制"""
+    admission_private_weight: float = 1.0
+    """公平调度中私聊会话相对于群聊会话的权重"""
+    busy_reply: str = "当前请求较多，请稍后再试~"
+    """排队已满或排队超时时的回复"""
 
 
 plugin_config = get_plugin_config(PluginConfig)
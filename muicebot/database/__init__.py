@@ -1,4 +1,16 @@
-from .crud import MessageORM, UserORM
-from .orm_models import Msg, User
+from .aggregator import usage_aggregator
+from .crud import MessageORM, SummaryORM, UserORM, run_after_transaction
+from .orm_models import Msg, Summary, User
+from .writer import message_writer
 
-__all__ = ["MessageORM", "UserORM", "Msg", "User"]
+__all__ = [
+    "MessageORM",
+    "SummaryORM",
+    "UserORM",
+    "Msg",
+    "Summary",
+    "User",
+    "message_writer",
+    "run_after_transaction",
+    "usage_aggregator",
+]
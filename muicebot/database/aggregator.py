@@ -0,0 +1,116 @@
+import asyncio
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+from nonebot import logger
+from nonebot_plugin_orm import get_session
+
+from ..config import plugin_config
+
+
+def _like(pattern: str, value: str) -> bool:
+    """
+    以 SQL `LIKE` 的语义匹配字符串
+    """
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.fullmatch(regex, value) is not None
+
+
+class UsageAggregator:
+    """
+    内存用量聚合器
+
+    模型调用时仅在内存中按 (插件, 类型, 日期) 累加用量，无需等待数据库；
+    每隔 `flush_interval` 秒将累计的增量以每个键一条 UPSERT 的方式写入 `Usage`
+    """
+
+    def __init__(self, flush_interval: float) -> None:
+        self.flush_interval = flush_interval
+        """刷新间隔（秒）"""
+
+        self._counters: defaultdict[tuple[str, str, str], int] = defaultdict(int)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, plugin: str, tokens: int, type: str = "chat"):
+        """
+        累加一次用量
+
+        :param plugin: 插件名称
+        :param tokens: 用量
+        :param type: 用量类型
+        """
+        if tokens < 0:
+            return
+
+        date = datetime.now().strftime("%Y.%m.%d")
+        self._counters[(plugin, type, date)] += tokens
+
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._spawn_flush)
+
+    def pending(self, plugin: Optional[str] = None, date: Optional[str] = None, type: Optional[str] = None) -> int:
+        """
+        获取尚未写入数据库的用量（过滤条件与 `UsageORM.get_usage` 一致）
+        """
+        return sum(
+            tokens
+            for (p, t, d), tokens in self._counters.items()
+            if (not plugin or p == plugin) and (not date or _like(date, d)) and (not type or t == type)
+        )
+
+    def _spawn_flush(self):
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> bool:
+        """
+        立即将累计的用量写入数据库
+
+        :return: 是否写入成功
+        """
+        from .crud import UsageORM
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # 先整体取出计数器，刷新期间产生的新用量会累加到新的计数器中
+        counters, self._counters = self._counters, defaultdict(int)
+        if not counters:
+            return True
+
+        try:
+            async with get_session() as session:
+                for (plugin, type, date), tokens in counters.items():
+                    await UsageORM.upsert_usage(session, plugin, type, date, tokens)
+                await session.commit()
+
+        except Exception as e:
+            logger.error(f"写入用量数据失败，将在下次刷新时重试: {e}")
+            for key, tokens in counters.items():
+                self._counters[key] += tokens
+            if self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._spawn_flush)
+            return False
+
+        return True
+
+    async def close(self):
+        """
+        关闭聚合器并写入剩余的用量
+        """
+        if not await self.flush():
+            logger.warning(f"有 {self.pending()} tokens 的用量记录未能写入数据库")
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+usage_aggregator = UsageAggregator(plugin_config.usage_flush_interval)
+"""全局用量聚合器"""
@@ -1,12 +1,77 @@
 import json
+import re
 from datetime import datetime
-from typing import List, Literal, Optional
+from typing import Any, Callable, Iterable, List, Literal, Optional, Union
 
-from nonebot_plugin_orm import async_scoped_session
-from sqlalchemy import desc, func, select, update
+from nonebot import logger
+from nonebot_plugin_orm import Model, async_scoped_session
+from sqlalchemy import Insert, delete, desc, event, func, select, text, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
 
 from ..models import Message, Resource
-from .orm_models import Msg, Usage, User
+from ..utils.cache import LRUCache
+from ..utils.tokens import estimate_message_tokens
+from .aggregator import usage_aggregator
+from .orm_models import MediaAlias, MediaBlob, Msg, MsgStat, Summary, Usage, User
+from .writer import message_writer
+
+_profile_cache: LRUCache[str, str] = LRUCache(maxsize=4096, ttl=600)
+"""用户存档缓存: userid -> profile"""
+
+_AFTER_TRANSACTION_KEY = "muicebot_after_transaction"
+"""会话 `info` 中记录待事务结束后执行的回调的键"""
+
+
+def run_after_transaction(session: Union[async_scoped_session, AsyncSession], callback: Callable[[], Any]):
+    """
+    在会话的当前事务结束（提交或回滚）后执行回调，用于使缓存失效
+
+    在事务提交前使缓存失效时，并发的读取可能在提交前重新缓存旧值；若会话不在事务中则立即执行
+
+    :param callback: 回调函数
+    """
+    async_session = session if isinstance(session, AsyncSession) else session()
+    sync_session = async_session.sync_session
+    if not sync_session.in_transaction():
+        callback()
+        return
+
+    callbacks = sync_session.info.get(_AFTER_TRANSACTION_KEY)
+    if callbacks is None:
+        callbacks = sync_session.info[_AFTER_TRANSACTION_KEY] = []
+        event.listen(sync_session, "after_transaction_end", _run_after_transaction)
+    callbacks.append(callback)
+
+
+def _run_after_transaction(session: Session, transaction: SessionTransaction):
+    callbacks = session.info.get(_AFTER_TRANSACTION_KEY)
+    if transaction.parent is not None or not callbacks:
+        return
+
+    for callback in callbacks:
+        callback()
+    callbacks.clear()
+
+
+def _insert_ignore(
+    session: Union[async_scoped_session, AsyncSession], model: type[Model], index_elements: list[str], **values
+) -> Insert:
+    """
+    构建一个在唯一键冲突时忽略写入的 INSERT 语句
+
+    :param model: ORM 模型
+    :param index_elements: 唯一键列名
+    :param values: 写入的值
+    """
+    dialect = session.get_bind(model).dialect.name
+
+    if dialect == "postgresql":
+        return postgresql.insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect in ("mysql", "mariadb"):
+        return mysql.insert(model).values(**values).prefix_with("IGNORE")
+    return sqlite.insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)
 
 
 class MessageORM:
@@ -16,6 +81,7 @@ class MessageORM:
         反序列化为 Message 实例
         """
         return Message(
+            id=row.id,
             time=row.time,
             userid=row.userid,
             groupid=row.groupid,
@@ -24,6 +90,7 @@ class MessageORM:
             resources=[Resource(**r) for r in json.loads(row.resources or "[]")],
             usage=row.usage,
             profile=row.profile,
+            tokens=row.tokens,
         )
 
     @staticmethod
@@ -48,18 +115,66 @@ class MessageORM:
         """
         resources = json.dumps([r.to_dict() for r in message.resources], ensure_ascii=False)
         profile = await UserORM.get_user_profile(session, message.userid)
-        session.add(
-            Msg(
-                time=message.time,
-                userid=message.userid,
-                groupid=message.groupid,
-                message=message.message,
-                respond=message.respond,
-                resources=resources,
-                usage=message.usage,
-                profile=profile,
-            )
+        message.tokens = estimate_message_tokens(message)
+        row = dict(
+            time=message.time,
+            userid=message.userid,
+            groupid=message.groupid,
+            message=message.message,
+            respond=message.respond,
+            resources=resources,
+            usage=message.usage,
+            profile=profile,
+            tokens=message.tokens,
         )
+        date = message.format_time.strftime("%Y.%m.%d")
+
+        await MediaORM.change_refcount(session, [r.path for r in message.resources if r.path], 1)
+
+        if message_writer.enabled:
+            message_writer.put_message(row, date)
+            return
+
+        msg = Msg(**row)
+        session.add(msg)
+        if message.usage != -1:
+            await MessageORM._update_daily_stat(session, date, 1, message.usage)
+
+        # 立即写入以获得消息 ID
+        await session.flush()
+        message.id = msg.id
+
+    @staticmethod
+    async def _update_daily_stat(
+        session: Union[async_scoped_session, AsyncSession], date: str, count: int, tokens: int
+    ):
+        """
+        增量更新指定日期的对话统计（单条 UPSERT 语句）
+
+        :param date: 日期(`%Y.%m.%d`)
+        :param count: 新增对话次数
+        :param tokens: 新增用量
+        """
+        values = dict(date=date, count=count, tokens=tokens)
+        dialect = session.get_bind(MsgStat).dialect.name
+
+        if dialect in ("mysql", "mariadb"):
+            mysql_stmt = mysql.insert(MsgStat).values(**values)
+            stmt: Insert = mysql_stmt.on_duplicate_key_update(
+                count=MsgStat.count + mysql_stmt.inserted.count, tokens=MsgStat.tokens + mysql_stmt.inserted.tokens
+            )
+        else:
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            conflict_stmt = insert(MsgStat).values(**values)
+            stmt = conflict_stmt.on_conflict_do_update(
+                index_elements=["date"],
+                set_={
+                    "count": MsgStat.count + conflict_stmt.excluded.count,
+                    "tokens": MsgStat.tokens + conflict_stmt.excluded.tokens,
+                },
+            )
+
+        await session.execute(stmt)
 
     @staticmethod
     async def get_user_history(session: async_scoped_session, userid: str, limit: int = 0) -> List[Message]:
@@ -71,6 +186,9 @@ class MessageORM:
 
         :return: 消息列表
         """
+        if message_writer.has_pending(userid=userid):
+            await message_writer.flush(session)
+
         profile = await UserORM.get_user_profile(session, userid)
         stmt = select(Msg).where(Msg.userid == userid, Msg.history == 1, Msg.profile == profile).order_by(desc(Msg.id))
         if limit:
@@ -79,6 +197,48 @@ class MessageORM:
         rows = result.scalars().all()
         return [MessageORM._convert(msg) for msg in rows][::-1]
 
+    @staticmethod
+    async def explain_history_queries(session: Union[async_scoped_session, AsyncSession]) -> dict[str, bool]:
+        """
+        检查对话历史查询的执行计划是否使用了对应的复合索引且无需额外排序（仅支持 SQLite 与 PostgreSQL）
+
+        PostgreSQL 在表较小时倾向于顺序扫描，因此在当前事务内关闭顺序扫描，仅验证索引可被使用；调用方不应提交该事务
+
+        :return: 查询名 -> 执行计划是否符合预期
+        """
+        dialect = session.get_bind(Msg).dialect
+        if dialect.name not in ("sqlite", "postgresql"):
+            return {}
+
+        user_filter = (Msg.userid == "", Msg.history == 1, Msg.profile == "")
+        checks = {
+            "get_user_history": (
+                select(Msg).where(*user_filter).order_by(desc(Msg.id)).limit(1),
+                "ix_muicebot_msg_user_history",
+            ),
+            "mark_history_as_unavailable": (
+                select(Msg.id, Msg.resources).where(*user_filter).order_by(desc(Msg.id)).limit(1),
+                "ix_muicebot_msg_user_history",
+            ),
+            "get_group_history": (
+                select(Msg).where(Msg.groupid == "", Msg.history == 1).order_by(desc(Msg.id)).limit(1),
+                "ix_muicebot_msg_group_history",
+            ),
+        }
+
+        if dialect.name == "postgresql":
+            await session.execute(text("SET LOCAL enable_seqscan = off"))
+        prefix = "EXPLAIN QUERY PLAN" if dialect.name == "sqlite" else "EXPLAIN"
+
+        results: dict[str, bool] = {}
+        for name, (stmt, index) in checks.items():
+            sql = stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+            rows = (await session.execute(text(f"{prefix} {sql}"))).all()
+            plan = "\n".join(str(row[-1]) for row in rows)
+            logger.debug(f"{name} 执行计划:\n{plan}")
+            results[name] = index in plan and not re.search(r"TEMP B-TREE|\bSort\b", plan)
+        return results
+
     @staticmethod
     async def get_group_history(session: async_scoped_session, groupid: str, limit: int = 0) -> List[Message]:
         """
@@ -89,6 +249,9 @@ class MessageORM:
 
         :return: 消息列表
         """
+        if message_writer.has_pending(groupid=groupid):
+            await message_writer.flush(session)
+
         stmt = select(Msg).where(Msg.groupid == groupid, Msg.history == 1).order_by(desc(Msg.id))
         if limit:
             stmt = stmt.limit(limit)
@@ -96,6 +259,54 @@ class MessageORM:
         rows = result.scalars().all()
         return [MessageORM._convert(msg) for msg in rows][::-1]
 
+    @staticmethod
+    async def get_private_history_after(
+        session: Union[async_scoped_session, AsyncSession], userid: str, profile: str, after_id: int, limit: int = 0
+    ) -> List[Message]:
+        """
+        获取用户指定存档中 ID 大于 `after_id` 的可用私聊对话（按 ID 升序）
+
+        :param after_id: 起始消息 ID（不含）
+        :param limit: (可选) 返回的最大长度，当该变量设为0时表示全部返回
+        """
+        if message_writer.has_pending(userid=userid):
+            await message_writer.flush(session)
+
+        stmt = (
+            select(Msg)
+            .where(
+                Msg.userid == userid,
+                Msg.profile == profile,
+                Msg.groupid == "-1",
+                Msg.history == 1,
+                Msg.id > after_id,
+            )
+            .order_by(Msg.id)
+        )
+        if limit:
+            stmt = stmt.limit(limit)
+        result = await session.execute(stmt)
+        return [MessageORM._convert(msg) for msg in result.scalars().all()]
+
+    @staticmethod
+    async def get_available_messages(
+        session: async_scoped_session, userid: str, profile: str, ids: Iterable[int]
+    ) -> List[Message]:
+        """
+        按 ID 获取用户指定存档中仍然可用的对话（按 ID 升序）
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+
+        stmt = (
+            select(Msg)
+            .where(Msg.id.in_(ids), Msg.userid == userid, Msg.profile == profile, Msg.history == 1)
+            .order_by(Msg.id)
+        )
+        result = await session.execute(stmt)
+        return [MessageORM._convert(msg) for msg in result.scalars().all()]
+
     @staticmethod
     async def mark_history_as_unavailable(
         session: async_scoped_session,
@@ -109,15 +320,25 @@ class MessageORM:
         :param profile: 消息所属存档
         :param limit: (可选)最大操作数
         """
+        if message_writer.has_pending(userid=userid):
+            await message_writer.flush(session)
+
         profile = await UserORM.get_user_profile(session, userid)
+
+        # 被标记的对话不再引用其多模态文件
+        stmt = (
+            select(Msg.id, Msg.resources)
+            .where(Msg.userid == userid, Msg.history == 1, Msg.profile == profile)
+            .order_by(desc(Msg.id))
+        )
         if limit:
-            subq = (
-                select(Msg.id)
-                .where(Msg.userid == userid, Msg.history == 1, Msg.profile == profile)
-                .order_by(desc(Msg.id))
-                .limit(limit)
-            )
-            sub_ids = (await session.execute(subq)).scalars().all()
+            stmt = stmt.limit(limit)
+        rows = (await session.execute(stmt)).all()
+        paths = [r["path"] for _, resources in rows for r in json.loads(resources or "[]") if r.get("path")]
+        await MediaORM.change_refcount(session, paths, -1)
+
+        if limit:
+            sub_ids = [msg_id for msg_id, _ in rows]
             if sub_ids:
                 await session.execute(update(Msg).where(Msg.id.in_(sub_ids)).values(history=0))
         else:
@@ -130,9 +351,9 @@ class MessageORM:
 
         :return: today_usage, total_usage
         """
-        total = await session.execute(select(func.sum(Msg.usage)).where(Msg.usage != -1))
+        total = await session.execute(select(func.sum(MsgStat.tokens)))
         today = await session.execute(
-            select(func.sum(Msg.usage)).where(Msg.usage != -1, Msg.time.like(f"{datetime.now().strftime('%Y.%m.%d')}%"))
+            select(func.sum(MsgStat.tokens)).where(MsgStat.date == datetime.now().strftime("%Y.%m.%d"))
         )
         return (today.scalar() or 0), (total.scalar() or 0)
 
@@ -143,26 +364,58 @@ class MessageORM:
 
         :return: today_count, total_count
         """
-        total = await session.execute(select(func.count()).where(Msg.usage != -1))
+        total = await session.execute(select(func.sum(MsgStat.count)))
         today = await session.execute(
-            select(func.count()).where(Msg.usage != -1, Msg.time.like(f"{datetime.now().strftime('%Y.%m.%d')}%"))
+            select(func.sum(MsgStat.count)).where(MsgStat.date == datetime.now().strftime("%Y.%m.%d"))
         )
         return (today.scalar() or 0), (total.scalar() or 0)
 
 
 class UserORM:
+    @staticmethod
+    async def _insert_user(session: async_scoped_session, userid: str):
+        """
+        插入用户记录，若用户已存在则忽略（不提交事务）
+        """
+        await session.execute(_insert_ignore(session, User, ["userid"], userid=userid))
+        run_after_transaction(session, lambda: _profile_cache.pop(userid))
+
     @staticmethod
     async def create_user(session: async_scoped_session, userid: str) -> User:
-        user = User(userid=userid)
-        session.add(user)
-        await session.commit()
-        return user
+        """
+        创建用户，若用户已存在则返回已有记录
+
+        该操作不会提交事务，由调用方统一提交
+        """
+        await UserORM._insert_user(session, userid)
+        result = await session.execute(select(User).where(User.userid == userid).limit(1))
+        return result.scalar_one()
 
     @staticmethod
     async def get_user(session: async_scoped_session, userid: str) -> User:
         user = await session.execute(select(User).where(User.userid == userid).limit(1))
         return user.scalar_one_or_none() or await UserORM.create_user(session, userid)
 
+    @staticmethod
+    async def get_nicknames(
+        session: async_scoped_session, userids: Optional[Iterable[str]] = None, limit: int = 0
+    ) -> dict[str, str]:
+        """
+        获取已记录的用户昵称（忽略未设置昵称的用户）
+
+        :param userids: (可选)用户id列表，为 None 时返回所有用户
+        :param limit: (可选)返回的最大数量，当该变量设为0时表示全部返回
+
+        :return: userid -> nickname
+        """
+        stmt = select(User.userid, User.nickname).where(User.nickname.is_not(None), User.nickname != "_default")
+        if userids is not None:
+            stmt = stmt.where(User.userid.in_(list(userids)))
+        if limit:
+            stmt = stmt.order_by(desc(User.id)).limit(limit)
+        result = await session.execute(stmt)
+        return {userid: nickname for userid, nickname in result.all()}
+
     @staticmethod
     async def set_nickname(session: async_scoped_session, userid: str, nickname: str):
         """
@@ -182,15 +435,28 @@ class UserORM:
         :param nickname: 消息存档名
         """
         await session.execute(update(User).where(User.userid == userid).values(profile=profile))
+        run_after_transaction(session, lambda: _profile_cache.pop(userid))
 
     @staticmethod
     async def get_user_profile(session: async_scoped_session, userid: str) -> str:
-        result = await session.execute(select(User.profile).where(User.userid == userid).limit(1))
-        profile = result.scalar_one_or_none()
+        """
+        获取用户当前的消息存档（优先从缓存中读取），若用户不存在则创建
+
+        :param userid: 用户id
+        """
+        profile = _profile_cache.get(userid)
         if profile is not None:
             return profile
-        await UserORM.create_user(session, userid)
-        return "_default"
+
+        result = await session.execute(select(User.profile).where(User.userid == userid).limit(1))
+        profile = result.scalar_one_or_none()
+
+        if profile is None:
+            await UserORM._insert_user(session, userid)
+            profile = "_default"
+
+        _profile_cache.set(userid, profile)
+        return profile
 
 
 class UsageORM:
@@ -199,7 +465,7 @@ class UsageORM:
         session: async_scoped_session,
         plugin: Optional[str],
         date: Optional[str],
-        type: Optional[Literal["chat", "embedding"]] = None,
+        type: Optional[Literal["chat", "embedding", "cache_hit", "cache_saved"]] = None,
     ) -> int:
         """
         获取用量信息
@@ -217,11 +483,14 @@ class UsageORM:
         if type:
             query = query.where(Usage.type == type)
         result = await session.execute(query)
-        return result.scalar() or 0
+        return (result.scalar() or 0) + usage_aggregator.pending(plugin, date, type)
 
     @staticmethod
     async def save_usage(
-        session: async_scoped_session, plugin: str, total_tokens: int, type: Literal["chat", "embedding"] = "chat"
+        session: async_scoped_session,
+        plugin: str,
+        total_tokens: int,
+        type: Literal["chat", "embedding", "cache_hit", "cache_saved"] = "chat",
     ):
         """
         保存用量信息
@@ -230,13 +499,157 @@ class UsageORM:
             return
 
         date = datetime.now().strftime("%Y.%m.%d")
-        stmt = await session.execute(
-            select(Usage).where(Usage.plugin == plugin, Usage.type == type, Usage.date == date).limit(1)
+        await UsageORM.upsert_usage(session, plugin, type, date, total_tokens)
+
+    @staticmethod
+    async def upsert_usage(
+        session: Union[async_scoped_session, AsyncSession], plugin: str, type: str, date: str, total_tokens: int
+    ):
+        """
+        在数据库中累加指定插件、类型、日期的用量（单条 UPSERT 语句）
+        """
+        values = dict(plugin=plugin, type=type, date=date, tokens=total_tokens)
+        dialect = session.get_bind(Usage).dialect.name
+
+        if dialect in ("mysql", "mariadb"):
+            mysql_stmt = mysql.insert(Usage).values(**values)
+            stmt: Insert = mysql_stmt.on_duplicate_key_update(tokens=Usage.tokens + mysql_stmt.inserted.tokens)
+        else:
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            conflict_stmt = insert(Usage).values(**values)
+            stmt = conflict_stmt.on_conflict_do_update(
+                index_elements=["plugin", "type", "date"],
+                set_={"tokens": Usage.tokens + conflict_stmt.excluded.tokens},
+            )
+
+        await session.execute(stmt)
+
+
+class SummaryORM:
+    @staticmethod
+    async def get_summary(
+        session: Union[async_scoped_session, AsyncSession], userid: str, profile: str
+    ) -> Optional[Summary]:
+        """
+        获取用户指定存档的对话历史摘要
+        """
+        result = await session.execute(
+            select(Summary).where(Summary.userid == userid, Summary.profile == profile).limit(1)
         )
-        usage = stmt.scalar_one_or_none()
+        return result.scalar_one_or_none()
 
-        if usage is not None:
-            usage.tokens += total_tokens
+    @staticmethod
+    async def save_summary(
+        session: Union[async_scoped_session, AsyncSession], userid: str, profile: str, content: str, last_msg_id: int
+    ):
+        """
+        保存对话历史摘要（覆盖已有摘要）
+
+        :param content: 摘要内容
+        :param last_msg_id: 摘要所覆盖的最后一条消息 ID
+        """
+        time = datetime.now().strftime("%Y.%m.%d %H:%M:%S")
+        summary = await SummaryORM.get_summary(session, userid, profile)
+
+        if summary is not None:
+            summary.content = content
+            summary.last_msg_id = last_msg_id
+            summary.time = time
             return
 
-        session.add(Usage(plugin=plugin, type=type, date=date, tokens=total_tokens))
+        session.add(Summary(userid=userid, profile=profile, content=content, last_msg_id=last_msg_id, time=time))
+
+    @staticmethod
+    async def delete_summary(session: async_scoped_session, userid: str, profile: str):
+        """
+        删除对话历史摘要 (适用于 reset 命令)
+        """
+        await session.execute(delete(Summary).where(Summary.userid == userid, Summary.profile == profile))
+
+
+class MediaORM:
+    @staticmethod
+    async def get_blob_by_alias(
+        session: Union[async_scoped_session, AsyncSession], keys: list[str]
+    ) -> Optional[MediaBlob]:
+        """
+        通过文件来源（URL、适配器文件 ID）查找已存储的文件
+
+        :param keys: 来源键列表（`url:<url>` 或 `id:<file_id>`），任意一个命中即可
+        """
+        result = await session.execute(
+            select(MediaBlob)
+            .join(MediaAlias, MediaAlias.hash == MediaBlob.hash)
+            .where(MediaAlias.key.in_(keys))
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def get_blob(session: Union[async_scoped_session, AsyncSession], hash: str) -> Optional[MediaBlob]:
+        """
+        通过内容哈希查找已存储的文件
+        """
+        result = await session.execute(select(MediaBlob).where(MediaBlob.hash == hash).limit(1))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def add_blob(
+        session: Union[async_scoped_session, AsyncSession], hash: str, path: str, size: int, keys: list[str]
+    ):
+        """
+        记录新存储的文件及其来源（已存在时忽略）
+        """
+        time = datetime.now().strftime("%Y.%m.%d %H:%M:%S")
+        await session.execute(
+            _insert_ignore(session, MediaBlob, ["hash"], hash=hash, path=path, size=size, refcount=0, time=time)
+        )
+        await MediaORM.add_aliases(session, hash, keys)
+
+    @staticmethod
+    async def add_aliases(session: Union[async_scoped_session, AsyncSession], hash: str, keys: list[str]):
+        """
+        为文件添加来源索引（已存在的来源保持不变）
+        """
+        for key in keys:
+            await session.execute(_insert_ignore(session, MediaAlias, ["key"], key=key, hash=hash))
+
+    @staticmethod
+    async def change_refcount(session: Union[async_scoped_session, AsyncSession], paths: list[str], delta: int):
+        """
+        调整文件的引用计数（不在存储中的路径将被忽略）
+
+        :param paths: 文件路径列表，同一路径出现多次时重复计数
+        :param delta: 每次引用的增量
+        """
+        counts: dict[str, int] = {}
+        for path in paths:
+            counts[path] = counts.get(path, 0) + 1
+
+        time = datetime.now().strftime("%Y.%m.%d %H:%M:%S")
+        for path, count in counts.items():
+            await session.execute(
+                update(MediaBlob)
+                .where(MediaBlob.path == path)
+                .values(refcount=MediaBlob.refcount + count * delta, time=time)
+            )
+
+    @staticmethod
+    async def get_unreferenced_blobs(
+        session: Union[async_scoped_session, AsyncSession], before: str
+    ) -> List[MediaBlob]:
+        """
+        获取在指定时间之前就已不再被引用的文件
+
+        :param before: 时间(`%Y.%m.%d %H:%M:%S`)
+        """
+        result = await session.execute(select(MediaBlob).where(MediaBlob.refcount <= 0, MediaBlob.time < before))
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def delete_blobs(session: Union[async_scoped_session, AsyncSession], hashes: list[str]):
+        """
+        删除文件记录及其来源索引
+        """
+        await session.execute(delete(MediaAlias).where(MediaAlias.hash.in_(hashes)))
+        await session.execute(delete(MediaBlob).where(MediaBlob.hash.in_(hashes)))
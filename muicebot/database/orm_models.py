@@ -1,9 +1,16 @@
 from nonebot_plugin_orm import Model
-from sqlalchemy import Integer, String, Text
+from sqlalchemy import Index, Integer, String, Text
 from sqlalchemy.orm import Mapped, mapped_column
 
 
 class Msg(Model):
+    __table_args__ = (
+        # 对应 get_user_history / mark_history_as_unavailable 的过滤与 id 倒序
+        Index("ix_muicebot_msg_user_history", "userid", "profile", "history", "id"),
+        # 对应 get_group_history 的过滤与 id 倒序
+        Index("ix_muicebot_msg_group_history", "groupid", "history", "id"),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     time: Mapped[str] = mapped_column(String, nullable=False)
     userid: Mapped[str] = mapped_column(String, nullable=False)
@@ -14,18 +21,67 @@ class Msg(Model):
     resources: Mapped[str] = mapped_column(Text, nullable=True, default="[]")
     usage: Mapped[int] = mapped_column(Integer, nullable=True, default=-1)
     profile: Mapped[str] = mapped_column(String, nullable=True, default="_default")
+    tokens: Mapped[int] = mapped_column(Integer, nullable=True)
 
 
 class User(Model):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    userid: Mapped[str] = mapped_column(String, nullable=False)
+    userid: Mapped[str] = mapped_column(String, nullable=False, index=True, unique=True)
     nickname: Mapped[str] = mapped_column(String, nullable=True, default="_default")
     profile: Mapped[str] = mapped_column(String, nullable=True, default="_default")
 
 
+class MsgStat(Model):
+    """对话数据的按日汇总（由 `MessageORM.add_item` 增量维护）"""
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    date: Mapped[str] = mapped_column(String, nullable=False, index=True, unique=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
 class Usage(Model):
+    __table_args__ = (Index("ix_muicebot_usage_key", "plugin", "type", "date", unique=True),)
+
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     plugin: Mapped[str] = mapped_column(String, primary_key=True)
     type: Mapped[str] = mapped_column(String, nullable=False)
     date: Mapped[str] = mapped_column(String, nullable=False)
     tokens: Mapped[int] = mapped_column(Integer, nullable=True, default=0)
+
+
+class Summary(Model):
+    """对话历史摘要（每个用户的每个存档一条，由 `HistorySummarizer` 增量维护）"""
+
+    __table_args__ = (Index("ix_muicebot_summary_key", "userid", "profile", unique=True),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    userid: Mapped[str] = mapped_column(String, nullable=False)
+    profile: Mapped[str] = mapped_column(String, nullable=False, default="_default")
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    last_msg_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    """摘要所覆盖的最后一条消息 ID"""
+    time: Mapped[str] = mapped_column(String, nullable=False)
+
+
+class MediaBlob(Model):
+    """按内容哈希去重存储的多模态文件"""
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    hash: Mapped[str] = mapped_column(String, nullable=False, index=True, unique=True)
+    """文件内容的 SHA-256"""
+    path: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    """引用该文件的可用对话数"""
+    time: Mapped[str] = mapped_column(String, nullable=False)
+    """最后一次被引用或使用的时间"""
+
+
+class MediaAlias(Model):
+    """文件来源（URL、适配器文件 ID）到内容哈希的索引"""
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    key: Mapped[str] = mapped_column(String, nullable=False, index=True, unique=True)
+    """`url:<url>` 或 `id:<file_id>`"""
+    hash: Mapped[str] = mapped_column(String, nullable=False, index=True)
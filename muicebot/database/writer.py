@@ -0,0 +1,229 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import Any, Optional, Union
+
+from nonebot import logger
+from nonebot_plugin_localstore import get_plugin_data_dir
+from nonebot_plugin_orm import async_scoped_session, get_session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+
+from ..config import plugin_config
+
+SPOOL_FILE = "pending_writes.json"
+"""关闭时未能落库的数据的暂存文件"""
+
+_PENDING_KEY = "muicebot_pending_writes"
+"""会话 `info` 中记录已并入事务但尚未提交的数据的键"""
+
+
+class MessageWriter:
+    """
+    延迟批量写入队列（write-behind）
+
+    将 `Msg` 写入与对话统计的增量合并为一次批量事务，在达到批量大小或最大刷新延迟时落库
+    """
+
+    def __init__(self, enabled: bool, batch_size: int, max_latency: float) -> None:
+        self.enabled = enabled
+        """是否启用延迟写入"""
+        self.batch_size = max(batch_size, 1)
+        """单批最大消息条数，达到后立即刷新"""
+        self.max_latency = max_latency
+        """最大刷新延迟（秒）"""
+
+        self._messages: list[dict[str, Any]] = []
+        self._stats: defaultdict[str, list[int]] = defaultdict(lambda: [0, 0])
+
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        """等待落库的消息条数"""
+        return len(self._messages)
+
+    def has_pending(self, userid: Optional[str] = None, groupid: Optional[str] = None) -> bool:
+        """
+        是否存在属于指定用户或群组的待写入消息
+        """
+        return any(
+            (userid is not None and row["userid"] == userid) or (groupid is not None and row["groupid"] == groupid)
+            for row in self._messages
+        )
+
+    def put_message(self, row: dict[str, Any], date: str):
+        """
+        加入一条待写入的消息
+
+        :param row: `Msg` 的列值
+        :param date: 消息日期(`%Y.%m.%d`)，用于合并当日统计
+        """
+        self._messages.append(row)
+
+        if row["usage"] != -1:
+            stat = self._stats[date]
+            stat[0] += 1
+            stat[1] += row["usage"]
+
+        self._schedule()
+
+    def _schedule(self):
+        if len(self._messages) >= self.batch_size:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_latency, self._spawn_flush)
+
+    def _spawn_flush(self):
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self) -> tuple[list[dict[str, Any]], dict[str, list[int]]]:
+        messages, stats = self._messages, dict(self._stats)
+        self._messages = []
+        self._stats.clear()
+        return messages, stats
+
+    def _restore(self, messages: list[dict[str, Any]], stats: dict[str, list[int]]):
+        self._messages[:0] = messages
+        for date, (count, tokens) in stats.items():
+            self._stats[date][0] += count
+            self._stats[date][1] += tokens
+
+    async def flush(self, session: Optional[Union[async_scoped_session, AsyncSession]] = None) -> bool:
+        """
+        立即将队列中的数据写入数据库
+
+        :param session: 调用方的数据库会话。传入时数据将并入该会话的事务中（由调用方负责提交），
+            避免调用方持有未提交的写事务时另开会话写入导致 SQLite 锁等待。
+            若该事务最终未被提交（回滚或直接关闭会话），数据将重新放回队列
+        :return: 是否写入成功（队列为空时视为成功）
+        """
+        from .crud import MessageORM
+        from .orm_models import Msg
+
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            messages, stats = self._take()
+            if not (messages or stats):
+                return True
+
+            async def _write(session: Union[async_scoped_session, AsyncSession]):
+                session.add_all([Msg(**row) for row in messages])
+                for date, (count, tokens) in stats.items():
+                    await MessageORM._update_daily_stat(session, date, count, tokens)
+
+            try:
+                if session is not None:
+                    await _write(session)
+                    await session.flush()
+                    self._track(session, messages, stats)
+                else:
+                    async with get_session() as new_session:
+                        await _write(new_session)
+                        await new_session.commit()
+
+            except Exception as e:
+                logger.error(f"批量写入数据库失败，数据将在下次刷新时重试: {e}")
+                self._restore(messages, stats)
+                if session is not None:
+                    raise
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.max_latency, self._spawn_flush)
+                return False
+
+        logger.debug(f"已批量写入 {len(messages)} 条消息")
+        return True
+
+    def _track(
+        self,
+        session: Union[async_scoped_session, AsyncSession],
+        messages: list[dict[str, Any]],
+        stats: dict[str, list[int]],
+    ):
+        """
+        跟踪并入调用方事务的数据：事务提交前不视为已落库，事务未提交即结束时重新放回队列
+        """
+        async_session = session if isinstance(session, AsyncSession) else session()
+        sync_session = async_session.sync_session
+
+        pending = sync_session.info.get(_PENDING_KEY)
+        if pending is None:
+            pending = sync_session.info[_PENDING_KEY] = []
+            event.listen(sync_session, "after_commit", self._after_commit)
+            event.listen(sync_session, "after_transaction_end", self._after_transaction_end)
+        pending.append((messages, stats))
+
+    @staticmethod
+    def _after_commit(session: Session):
+        session.info.get(_PENDING_KEY, []).clear()
+
+    def _after_transaction_end(self, session: Session, transaction: SessionTransaction):
+        pending = session.info.get(_PENDING_KEY)
+        if transaction.parent is not None or not pending:
+            return
+
+        for messages, stats in reversed(pending):
+            self._restore(messages, stats)
+        logger.warning(f"调用方事务未提交，{sum(len(messages) for messages, _ in pending)} 条消息已重新加入写入队列")
+        pending.clear()
+
+        try:
+            self._schedule()
+        except RuntimeError:  # 事件循环已关闭，交由 close 处理
+            pass
+
+    async def close(self):
+        """
+        关闭队列：刷新所有待写入数据，失败时将其暂存到本地文件，待下次启动时恢复
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if await self.flush():
+            return
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        messages, stats = self._take()
+        spool_path = get_plugin_data_dir() / SPOOL_FILE
+        data = {"messages": messages, "stats": stats}
+        with open(spool_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        logger.warning(f"有 {len(messages)} 条消息未能落库，已暂存至 {spool_path}")
+
+    async def recover(self):
+        """
+        恢复上次关闭时暂存的数据并写入数据库
+        """
+        spool_path = get_plugin_data_dir() / SPOOL_FILE
+        if not spool_path.exists():
+            return
+
+        with open(spool_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        self._restore(data.get("messages", []), data.get("stats", {}))
+        spool_path.unlink()
+
+        logger.info(f"正在恢复 {len(data.get('messages', []))} 条暂存消息...")
+        await self.flush()
+
+
+message_writer = MessageWriter(
+    plugin_config.enable_write_behind,
+    plugin_config.write_behind_batch_size,
+    plugin_config.write_behind_max_latency,
+)
+"""全局延迟写入队列"""
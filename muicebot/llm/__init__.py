@@ -2,7 +2,8 @@ from ._base import BaseLLM, EmbeddingModel
 from ._config import EmbeddingConfig, ModelConfig
 from ._dependencies import MODEL_DEPENDENCY_MAP, get_missing_dependencies
 from ._schema import ModelCompletions, ModelRequest, ModelStreamCompletions
-from .loader import load_embedding_model, load_model
+from ._vector_index import VectorIndex
+from .loader import close_embedding_models, load_embedding_model, load_model
 from .registry import get_embedding_class, get_llm_class, register
 
 __all__ = [
@@ -13,6 +14,7 @@ __all__ = [
     "ModelRequest",
     "ModelCompletions",
     "ModelStreamCompletions",
+    "VectorIndex",
     "MODEL_DEPENDENCY_MAP",
     "get_missing_dependencies",
     "register",
@@ -20,4 +22,5 @@ __all__ = [
     "get_embedding_class",
     "load_model",
     "load_embedding_model",
+    "close_embedding_models",
 ]
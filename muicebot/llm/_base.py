@@ -1,18 +1,27 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
-import json
 from abc import ABC, abstractmethod
-from functools import lru_cache
-from pathlib import Path
-from typing import Any, AsyncGenerator, Literal, Optional, Union, overload
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Literal,
+    Optional,
+    Union,
+    overload,
+)
 
 import numpy as np
 from nonebot import logger
 from nonebot_plugin_localstore import get_plugin_data_dir
 from numpy import ndarray
 
+from ..utils.cache import LRUCache
 from ._config import EmbeddingConfig, ModelConfig
+from ._embedding_store import EmbeddingStore, text_key
 from ._schema import (
     EmbeddingsBatchResult,
     ModelCompletions,
@@ -28,6 +37,12 @@ class BaseLLM(ABC):
     推荐使用该基类中定义的方法构建模型加载器类，但无论如何都必须实现 `ask` 方法
     """
 
+    preprocess_resources: bool = True
+    """是否在调用 `ask` 前按模型配置预处理多模态资源（路由等转发请求的模型加载器应设为 False，由实际调用的模型处理）"""
+
+    _provider_ask: Any
+    """仅包含资源预处理的 `ask`（不经过缓存、合并与用量记录），供路由等上层直接调用"""
+
     def __init__(self, model_config: ModelConfig) -> None:
         """
         统一在此处声明变量
@@ -36,20 +51,30 @@ class BaseLLM(ABC):
         """模型配置"""
         self.is_running = False
         """模型状态"""
+        self._active_calls = 0
+        """进行中的调用数（包括未结束的流式输出）"""
+        self._idle = asyncio.Event()
+        self._idle.set()
 
     def __init_subclass__(cls, **kwargs):
         """
-        对实现类中的 `ask` 函数包装 `record_plugin_usage` 装饰器
+        对实现类中的 `ask` 函数包装 `record_plugin_usage`、`cache_completions`、`coalesce_requests` 与 `prepare_resources` 装饰器
         """
-        from ._wrapper import record_plugin_usage
+        from ._wrapper import (
+            cache_completions,
+            coalesce_requests,
+            prepare_resources,
+            record_plugin_usage,
+        )
 
         super().__init_subclass__(**kwargs)
 
         # 1. Get the original 'ask' method from the new subclass
         original_ask = cls.ask
+        cls._provider_ask = prepare_resources(original_ask) if cls.preprocess_resources else original_ask
 
         # 2. Wrap it with the decorator
-        decorated_ask = record_plugin_usage(original_ask)
+        decorated_ask = record_plugin_usage(cache_completions(coalesce_requests(cls._provider_ask)))
 
         # 3. Replace the original method on the subclass with the decorated version
         setattr(cls, "ask", decorated_ask)
@@ -79,6 +104,33 @@ class BaseLLM(ABC):
         self.is_running = True
         return True
 
+    async def close(self) -> None:
+        """
+        释放模型占用的资源（如网络连接池），在模型被替换或驱动关闭时调用
+        """
+        self.is_running = False
+
+    @asynccontextmanager
+    async def in_use(self) -> AsyncIterator[BaseLLM]:
+        """
+        在调用期间登记对模型实例的引用，使 `close_when_idle` 等待调用结束后再释放资源
+        """
+        self._active_calls += 1
+        self._idle.clear()
+        try:
+            yield self
+        finally:
+            self._active_calls -= 1
+            if not self._active_calls:
+                self._idle.set()
+
+    async def close_when_idle(self) -> None:
+        """
+        等待进行中的调用全部结束后关闭模型（用于关闭配置重载后被替换的模型实例）
+        """
+        await self._idle.wait()
+        await self.close()
+
     async def _ask_sync(
         self, messages: list, tools: Any, response_format: Any, total_tokens: int = 0
     ) -> "ModelCompletions":
@@ -118,6 +170,23 @@ class BaseLLM(ABC):
         pass
 
 
+_MEMORY_ENTRY_OVERHEAD = 256
+"""内存缓存中每个条目除向量数据外的估计开销（文本哈希键与数组对象），计入字节上限"""
+
+
+def _nbytes(embedding: ndarray) -> int:
+    return embedding.nbytes + _MEMORY_ENTRY_OVERHEAD
+
+
+def _memory_copy(embedding: Union[ndarray, list[float]]) -> ndarray:
+    """
+    复制一份只读向量存入内存缓存（不持有内存映射的视图，避免引用整个矩阵文件）
+    """
+    copied = np.array(embedding, dtype=np.float32)
+    copied.flags.writeable = False
+    return copied
+
+
 class EmbeddingModel(ABC):
     """
     嵌入模型基类，所有模型加载器都必须继承于该类
@@ -125,6 +194,9 @@ class EmbeddingModel(ABC):
     推荐使用该基类中定义的方法构建模型加载器类，但无论如何都必须实现 `embed` 方法
     """
 
+    max_batch_size: int = 64
+    """单次 `embed` 调用接受的最大文本数（超出时由缓存层自动分批）"""
+
     def __init__(self, config: EmbeddingConfig):
         from ..config import plugin_config
 
@@ -137,6 +209,14 @@ class EmbeddingModel(ABC):
         else:
             self.cache_dir = None
 
+        self._embedding_store: Optional[EmbeddingStore] = None
+        self._memory_cache: Optional[LRUCache[str, ndarray]] = None
+        """内存缓存: text_key(text) -> 向量副本"""
+        if self.enable_embedding_cache and plugin_config.embedding_memory_cache_size > 0:
+            self._memory_cache = LRUCache(
+                maxsize=0, maxbytes=plugin_config.embedding_memory_cache_size * 1024 * 1024, sizeof=_nbytes
+            )
+
     def __init_subclass__(cls, **kwargs):
         """
         对实现类中的 `embed` 函数包装 `record_plugin_embedding_usage` 装饰器
@@ -159,91 +239,117 @@ class EmbeddingModel(ABC):
         if missing_fields:
             raise ValueError(f"对于 {self.config.provider} 嵌入模型，以下配置是必需的: {', '.join(missing_fields)}")
 
-    def _get_embedding_cache_path(self, text: str) -> Optional[Path]:
+    async def close(self) -> None:
         """
-        获取嵌入缓存文件路径
+        释放嵌入模型占用的资源（如网络连接池与向量存储），在驱动关闭时调用
 
-        :param text: 查询文本
+        重写该方法时请调用 `super().close()` 以关闭向量存储
+        """
+        if self._embedding_store is not None:
+            self._embedding_store.close()
+            self._embedding_store = None
+
+    def _get_embedding_store(self) -> Optional[EmbeddingStore]:
+        """
+        获取（首次调用时打开）当前模型的嵌入向量存储，首次打开时导入旧版缓存文件
         """
         if not self.cache_dir:
             return None
 
-        # 根据文本和模型名称生成缓存键
-        content = f"{self.config.model}:{text}"
-        cache_key = hashlib.md5(content.encode("utf-8"), usedforsecurity=False).hexdigest()
+        if self._embedding_store is None:
+            identity = f"{self.__class__.__name__}:{self.config.api_host}:{self.config.model}"
+            namespace = hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+            self._embedding_store = EmbeddingStore(self.cache_dir, namespace)
+            self._embedding_store.import_legacy(
+                self.cache_dir, self.__class__.__name__, self.config.api_host, self.config.model
+            )
 
-        return self.cache_dir / cache_key
+        return self._embedding_store
 
-    @lru_cache(maxsize=256)
-    def _load_embedding_from_cache(self, text: str) -> Optional[ndarray]:
+    def _load_embeddings_from_cache(self, texts: list[str]) -> list[Optional[ndarray]]:
         """
-        从缓存文件中加载嵌入向量
+        批量从缓存中加载嵌入向量
 
-        :param text: 查询文本
+        :param texts: 查询文本列表
+        :return: 与 `texts` 一一对应的嵌入向量（只读），未命中为 None
         """
         if not self.enable_embedding_cache:
-            return None
+            return [None] * len(texts)
 
-        try:
-            cache_path = self._get_embedding_cache_path(text)
-            if not cache_path:
-                return None
-
-            meta_path = cache_path.with_suffix(".json")
-            npy_path = cache_path.with_suffix(".npy")
-
-            if not (meta_path.exists() and npy_path.exists()):
-                return None
-
-            with open(meta_path, "r", encoding="utf-8") as f:
-                meta = json.load(f)
-
-            if (
-                isinstance(meta, dict)
-                and meta.get("provider", None) == self.__class__.__name__
-                and meta.get("api_host", None) == self.config.api_host
-                and meta.get("model", None) == self.config.model
-                and meta.get("text_hash", "") == hashlib.sha256(text.encode("utf-8")).hexdigest()
-            ):
-                embedding = np.load(npy_path)
-                logger.debug(f"从缓存加载嵌入向量: {text[:50]}...")
-                return embedding
-            return None
+        results: list[Optional[ndarray]] = [None] * len(texts)
+        if self._memory_cache is not None:
+            for index, text in enumerate(texts):
+                results[index] = self._memory_cache.get(text_key(text))
 
+        pending = [index for index, embedding in enumerate(results) if embedding is None]
+        if not pending:
+            return results
+
+        try:
+            store = self._get_embedding_store()
+            if not store:
+                return results
+            embeddings = store.get_many([texts[index] for index in pending])
         except Exception as e:
             logger.warning(f"加载缓存失败: {e}")
-            return None
+            return results
 
-    def _save_to_cache(self, text: str, embedding: list[float]) -> None:
-        """
-        将嵌入向量保存到缓存文件
-        """
-        if not self.enable_embedding_cache or not self.cache_dir:
-            return
+        for index, embedding in zip(pending, embeddings):
+            if embedding is None:
+                continue
+            results[index] = embedding
+            if self._memory_cache is not None:
+                self._memory_cache.set(text_key(texts[index]), _memory_copy(embedding))
 
-        try:
-            cache_path = self._get_embedding_cache_path(text)
-            if not cache_path:
-                return
+        return results
 
-            meta_path = cache_path.with_suffix(".json")
-            npy_path = cache_path.with_suffix(".npy")
+    def _load_embedding_from_cache(self, text: str) -> Optional[ndarray]:
+        """
+        从缓存中加载嵌入向量
 
-            meta_data = {
-                "provider": self.__class__.__name__,
-                "api_host": self.config.api_host,
-                "model": self.config.model,
-                "text_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
-            }
+        :param text: 查询文本
+        """
+        return self._load_embeddings_from_cache([text])[0]
 
-            with open(meta_path, "w", encoding="utf-8") as f:
-                json.dump(meta_data, f)
-            np.save(npy_path, np.array(embedding), allow_pickle=False)
+    def _save_embeddings_to_cache(self, texts: list[str], embeddings: list[list[float]]) -> None:
+        """
+        批量将嵌入向量保存到缓存
+        """
+        if not self.enable_embedding_cache:
+            return
+
+        if self._memory_cache is not None:
+            for text, embedding in zip(texts, embeddings):
+                self._memory_cache.set(text_key(text), _memory_copy(embedding))
 
-            logger.debug(f"嵌入向量已缓存: {text[:50]}...")
+        try:
+            store = self._get_embedding_store()
+            if store:
+                store.put_many(texts, embeddings)
+                logger.debug(f"已缓存 {len(texts)} 条嵌入向量")
         except Exception as e:
             logger.warning(f"保存缓存失败: {e}")
 
+    def _save_to_cache(self, text: str, embedding: list[float]) -> None:
+        """
+        将嵌入向量保存到缓存
+        """
+        self._save_embeddings_to_cache([text], [embedding])
+
+    def cache_stats(self) -> dict[str, int]:
+        """
+        获取内存嵌入缓存的命中、未命中次数与当前占用
+        """
+        if self._memory_cache is None:
+            return {"hits": 0, "misses": 0, "entries": 0, "bytes": 0}
+
+        return {
+            "hits": self._memory_cache.hits,
+            "misses": self._memory_cache.misses,
+            "entries": len(self._memory_cache),
+            "bytes": self._memory_cache.nbytes,
+        }
+
     @abstractmethod
     async def embed(self, texts: list[str]) -> "EmbeddingsBatchResult":
         """
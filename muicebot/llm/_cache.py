@@ -0,0 +1,215 @@
+"""
+模型回复缓存：按规范化后的请求内容精确匹配，可选按提示词的嵌入相似度语义匹配
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+from nonebot import logger
+from numpy import ndarray
+
+from ..utils.cache import LRUCache
+from ._schema import ModelCompletions, ModelRequest
+
+if TYPE_CHECKING:
+    from ._base import EmbeddingModel
+    from ._config import ModelConfig
+
+
+def _normalize(text: str) -> str:
+    """
+    规范化文本：去除首尾空白并合并连续空白
+    """
+    return " ".join(text.split())
+
+
+def _hash(payload: object) -> str:
+    content = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def request_keys(request: ModelRequest, config: ModelConfig) -> tuple[str, str]:
+    """
+    计算请求的规范化哈希
+
+    :return: (完整请求键, 除提示词外的上下文键)
+    """
+    context = {
+        "provider": config.provider,
+        "model": config.model_name,
+        "host": config.api_host,
+        "system": _normalize(request.system or ""),
+        "history": [
+            [_normalize(item.message), item.respond, [r.path for r in item.resources]] for item in request.history
+        ],
+        "resources": [r.path for r in request.resources],
+        "tools": request.tools or [],
+        "format": request.format,
+        "schema": request.json_schema.model_json_schema() if request.json_schema else None,
+    }
+    context_key = _hash(context)
+    return _hash([context_key, _normalize(request.prompt)]), context_key
+
+
+@dataclass
+class CacheLookup:
+    """
+    缓存查询结果
+    """
+
+    key: str
+    """精确匹配键"""
+    context_key: str
+    """除提示词外的上下文键（语义匹配只在相同上下文中进行）"""
+    completions: Optional[ModelCompletions] = None
+    """命中的回复"""
+    saved_usage: int = 0
+    """命中的回复在生成时的用量"""
+    vector: Optional[ndarray] = None
+    """提示词的归一化嵌入（语义模式）"""
+
+
+class CompletionCache:
+    """
+    进程内模型回复缓存
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self._entries: LRUCache[str, tuple[float, ModelCompletions, str]] = LRUCache(
+            maxsize=maxsize, on_remove=self._remove_vector
+        )
+        """精确匹配键 -> (过期时间, 回复, 上下文键)"""
+        self._vectors: dict[str, dict[str, ndarray]] = {}
+        """上下文键 -> {精确匹配键: 提示词嵌入}（随回复条目的淘汰或过期一并移除）"""
+        self._embedding_model: Optional[EmbeddingModel] = None
+        self._embedding_unavailable = False
+
+    @staticmethod
+    def bypass(request: ModelRequest, config: ModelConfig) -> bool:
+        """
+        请求是否应跳过缓存（包含工具或多模态资源且未显式允许时）
+        """
+        if request.tools and not config.completion_cache_allow_tools:
+            return True
+        has_resources = request.resources or any(item.resources for item in request.history)
+        return bool(has_resources) and not config.completion_cache_allow_resources
+
+    def _get_embedding_model(self) -> Optional[EmbeddingModel]:
+        if self._embedding_model is None and not self._embedding_unavailable:
+            from ..config import get_embedding_model_config
+            from .loader import load_embedding_model
+
+            try:
+                self._embedding_model = load_embedding_model(get_embedding_model_config())
+            except Exception as e:
+                logger.warning(f"语义缓存不可用，仅使用精确匹配: {e}")
+                self._embedding_unavailable = True
+        return self._embedding_model
+
+    async def _embed(self, text: str) -> Optional[ndarray]:
+        model = self._get_embedding_model()
+        if model is None:
+            return None
+
+        result = await model.embed([text])
+        if not result.succeed or not result.embeddings:
+            return None
+
+        vector = np.asarray(result.embeddings[0], dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def _remove_vector(self, key: str, entry: tuple[float, ModelCompletions, str]):
+        context_key = entry[2]
+        vectors = self._vectors.get(context_key)
+        if vectors is None:
+            return
+        vectors.pop(key, None)
+        if not vectors:
+            del self._vectors[context_key]
+
+    def _get_entry(self, key: str) -> Optional[ModelCompletions]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expire_at, completions, _ = entry
+        if expire_at < time.monotonic():
+            self._entries.pop(key)
+            return None
+
+        return completions
+
+    def _search(self, context_key: str, vector: ndarray, threshold: float) -> Optional[ModelCompletions]:
+        candidates = self._vectors.get(context_key)
+        if not candidates:
+            return None
+
+        keys = list(candidates)
+        scores = np.stack(list(candidates.values())) @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+
+        return self._get_entry(keys[best])
+
+    async def lookup(self, request: ModelRequest, config: ModelConfig) -> CacheLookup:
+        """
+        查询缓存
+
+        :return: 查询结果。命中时 `completions` 为缓存回复的副本（用量为 0）
+        """
+        key, context_key = request_keys(request, config)
+        lookup = CacheLookup(key, context_key, self._get_entry(key))
+
+        if lookup.completions is None and config.completion_cache_semantic:
+            lookup.vector = await self._embed(_normalize(request.prompt))
+            if lookup.vector is not None:
+                lookup.completions = self._search(context_key, lookup.vector, config.completion_cache_threshold)
+
+        if lookup.completions is not None:
+            lookup.saved_usage = max(lookup.completions.usage, 0)
+            lookup.completions = replace(lookup.completions, usage=0, resources=list(lookup.completions.resources))
+
+        return lookup
+
+    def store(self, lookup: CacheLookup, completions: ModelCompletions, ttl: float):
+        """
+        写入缓存（失败的回复不会被缓存）
+        """
+        if not completions.succeed or ttl <= 0:
+            return
+
+        self._entries.set(lookup.key, (time.monotonic() + ttl, completions, lookup.context_key))
+        if lookup.vector is not None:
+            self._vectors.setdefault(lookup.context_key, {})[lookup.key] = lookup.vector
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        self._entries.clear()
+        self._vectors.clear()
+
+
+_completion_cache: Optional[CompletionCache] = None
+
+
+def get_completion_cache() -> CompletionCache:
+    """
+    获取全局模型回复缓存
+    """
+    global _completion_cache
+
+    if _completion_cache is None:
+        from ..config import plugin_config
+
+        _completion_cache = CompletionCache(plugin_config.completion_cache_size)
+
+    return _completion_cache
@@ -0,0 +1,155 @@
+"""
+相同请求合并（single-flight）：并发的相同请求共享一次上游调用
+"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import replace
+from typing import AsyncGenerator, Awaitable, Callable, Optional
+
+from ._schema import ModelCompletions, ModelStreamCompletions
+
+
+class _Flight:
+    """
+    一次进行中的非流式上游调用
+    """
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.subscribers = 0
+
+
+class _StreamFlight:
+    """
+    一次进行中的流式上游调用：输出块被缓存，后加入的订阅者先重放已产生的输出块
+    """
+
+    def __init__(self) -> None:
+        self.chunks: list[ModelStreamCompletions] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    async def produce(self, func: Callable[[], Awaitable[AsyncGenerator[ModelStreamCompletions, None]]]):
+        response: Optional[AsyncGenerator[ModelStreamCompletions, None]] = None
+        try:
+            response = await func()
+            async for chunk in response:
+                async with self.changed:
+                    self.chunks.append(chunk)
+                    self.changed.notify_all()
+        except BaseException as e:
+            self.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            if response is not None:
+                await response.aclose()
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+
+class RequestCoalescer:
+    """
+    相同请求合并器
+
+    首个请求发起上游调用，调用完成前到达的相同请求直接等待（或订阅）该调用的结果；
+    每个订阅者获得结果的独立副本，只有首个订阅者获得真实用量，其余订阅者的用量记为 0。所有订阅者都离开后上游调用被取消
+    """
+
+    def __init__(self) -> None:
+        self._flights: dict[str, _Flight] = {}
+        self._streams: dict[str, _StreamFlight] = {}
+
+    async def call(self, key: str, func: Callable[[], Awaitable[ModelCompletions]]) -> ModelCompletions:
+        """
+        合并非流式调用
+
+        :param key: 请求键
+        :param func: 发起上游调用的函数
+        """
+        flight = self._flights.get(key)
+        if flight is not None and flight.task.done():
+            flight = None  # 已结束（或被取消）但尚未执行完成回调的调用不再接受新的订阅者
+        leader = flight is None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._discard(self._flights, key, task))
+
+        flight.subscribers += 1
+        try:
+            completions = await asyncio.shield(flight.task)
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.task.done():
+                flight.task.cancel()
+
+        return replace(completions, usage=completions.usage if leader else 0, resources=list(completions.resources))
+
+    async def stream(
+        self, key: str, func: Callable[[], Awaitable[AsyncGenerator[ModelStreamCompletions, None]]]
+    ) -> AsyncGenerator[ModelStreamCompletions, None]:
+        """
+        合并流式调用
+
+        :param key: 请求键
+        :param func: 发起上游流式调用的函数
+        """
+        flight = self._streams.get(key)
+        if flight is not None and (flight.task is None or flight.task.done()):
+            flight = None
+        leader = flight is None
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.create_task(flight.produce(func))
+            flight.task.add_done_callback(lambda task: self._discard(self._streams, key, task))
+
+        return self._subscribe(flight, leader)
+
+    @staticmethod
+    def _discard(flights: dict, key: str, task: asyncio.Task):
+        """
+        调用结束后移除其记录（若记录已被新的调用替换则保留）
+        """
+        flight = flights.get(key)
+        if flight is not None and flight.task is task:
+            del flights[key]
+
+    async def _subscribe(self, flight: _StreamFlight, leader: bool) -> AsyncGenerator[ModelStreamCompletions, None]:
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: index < len(flight.chunks) or flight.done)
+                    chunks = flight.chunks[index:]
+                    done = flight.done
+
+                for chunk in chunks:
+                    # 订阅者可能修改输出块（如流式挂钩），因此每个订阅者都获得副本
+                    yield replace(
+                        chunk,
+                        usage=chunk.usage if leader else 0,
+                        resources=list(chunk.resources) if chunk.resources is not None else None,
+                    )
+                index += len(chunks)
+
+                if done and index >= len(flight.chunks):
+                    break
+
+            if flight.error is not None and not isinstance(flight.error, asyncio.CancelledError):
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and flight.task is not None and not flight.task.done():
+                flight.task.cancel()
+
+
+request_coalescer = RequestCoalescer()
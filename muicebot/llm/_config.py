@@ -1,5 +1,5 @@
 from importlib.util import find_spec
-from typing import Any, List, Literal, Optional
+from typing import Any, List, Literal, Optional, Union
 from warnings import warn
 
 from pydantic import BaseModel, field_validator, model_validator
@@ -20,6 +20,8 @@ class ModelConfig(BaseModel):
 
     max_tokens: int = 4096
     """最大回复 Tokens """
+    max_context_tokens: int = 0
+    """模型上下文窗口大小（Tokens）。设置后将按 Token 预算截取对话历史（扣除 max_tokens 与当前提示词），0 表示不启用"""
     temperature: float = 0.75
     """模型的温度系数"""
     top_p: float = 0.95
@@ -64,11 +66,51 @@ class ModelConfig(BaseModel):
 
     multimodal: bool = False
     """是否为（或启用）多模态模型"""
+    image_max_edge: int = 0
+    """图片上传前缩放到的最长边像素，0 表示不处理（需要安装 `pillow`）"""
+    image_format: Literal["jpeg", "webp", "png"] = "jpeg"
+    """缩放后图片的重新编码格式"""
+    image_quality: int = 85
+    """重新编码的图片质量（对 `png` 无效）"""
     modalities: List[Literal["text", "audio", "image"]] = ["text"]
     """生成模态"""
     audio: Optional[Any] = None
     """多模态音频参数"""
 
+    enable_completion_cache: bool = False
+    """启用模型回复缓存：有效期内相同的请求直接返回缓存的回复"""
+    completion_cache_ttl: float = 3600
+    """回复缓存的有效期（秒）"""
+    completion_cache_semantic: bool = False
+    """启用语义缓存：上下文相同且提示词的嵌入相似度达到阈值时视为相同请求（使用默认嵌入模型）"""
+    completion_cache_threshold: float = 0.95
+    """语义缓存的相似度阈值（余弦相似度）"""
+    completion_cache_allow_tools: bool = False
+    """允许缓存带有工具的请求"""
+    completion_cache_allow_resources: bool = False
+    """允许缓存带有多模态资源的请求"""
+
+    enable_request_coalescing: bool = False
+    """合并并发的相同请求：调用完成前到达的相同请求共享同一次上游调用（带有工具的请求除外）"""
+
+    max_concurrency: int = 0
+    """同时进行的最大模型调用数，超出的请求将排队，0 表示不限制"""
+    rate_limit_rpm: int = 0
+    """每分钟最大模型调用数（令牌桶限速），0 表示不限制"""
+    rate_limit_burst: int = 1
+    """令牌桶容量，即允许的最大突发调用数"""
+
+    routes: List[Union[str, dict]] = []
+    """路由提供者（`router`）组合的端点：models.yml 中的配置名或内联配置，按优先级排序"""
+    hedge_delay: Optional[float] = None
+    """对冲请求的等待时间（秒）：当前端点超时未响应时向下一个端点发起相同请求。为空时按端点延迟的 p95 自动计算，0 表示禁用"""
+    route_timeout: float = 0
+    """路由提供者中单个端点的请求超时（秒），0 表示不限制"""
+    circuit_failure_threshold: int = 3
+    """端点连续失败多少次后熔断"""
+    circuit_reset_timeout: float = 30.0
+    """熔断后多久允许再次尝试该端点（秒）"""
+
     @field_validator("provider")
     @classmethod
     def check_model_loader(cls, provider: str) -> str:
@@ -111,6 +153,11 @@ class EmbeddingConfig(BaseModel):
     api_host: str = ""
     """自定义 API 地址"""
 
+    batch_size: Optional[int] = None
+    """单次请求的最大文本数，为空时使用嵌入模型实现的默认值"""
+    max_concurrency: int = 4
+    """分批查询时的最大并发请求数"""
+
     # binding_model_config: Optional[str] = None
     # """
     # 绑定的模型配置。如果切换模型，会查找该模型所绑定的嵌入配置。如果不指定绑定配置，则不切换。
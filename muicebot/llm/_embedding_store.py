@@ -0,0 +1,263 @@
+"""
+嵌入向量存储：所有向量以 float32 追加写入同一个内存映射矩阵文件，由 SQLite 维护文本哈希到行号的索引
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from nonebot import logger
+from numpy import ndarray
+
+_SQL_BATCH = 500
+"""单条 SQL 语句中的最大参数数"""
+
+_COMPACT_RATIO = 0.25
+"""打开存储时，无索引引用的行占比超过该值则自动压缩"""
+
+
+def text_key(text: str) -> str:
+    """
+    计算文本的索引键
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    单个嵌入模型（提供者、地址与模型名）的向量存储
+
+    查询返回内存映射矩阵的只读视图（零拷贝）；删除或崩溃遗留的无引用行可通过 `compact` 回收
+    """
+
+    def __init__(self, directory: Path, namespace: str) -> None:
+        """
+        :param directory: 存储目录
+        :param namespace: 存储命名空间，不同模型的向量分别存储
+        """
+        self.namespace = namespace
+        self.matrix_path = directory / f"{namespace}.f32"
+        self.dim = 0
+        """向量维度（首次写入时确定）"""
+
+        self._db = sqlite3.connect(directory / "index.sqlite3")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (ns TEXT NOT NULL, key TEXT NOT NULL, row INTEGER NOT NULL, "
+            "PRIMARY KEY (ns, key))"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS matrices (ns TEXT PRIMARY KEY, dim INTEGER NOT NULL)")
+        self._db.commit()
+
+        row = self._db.execute("SELECT dim FROM matrices WHERE ns = ?", (namespace,)).fetchone()
+        self.dim = row[0] if row else 0
+
+        self._matrix: Optional[np.memmap] = None
+
+        if self.dim and self.orphan_ratio() > _COMPACT_RATIO:
+            self.compact()
+
+    @property
+    def rows(self) -> int:
+        """
+        矩阵文件中的行数
+        """
+        if not self.dim or not self.matrix_path.exists():
+            return 0
+        return self.matrix_path.stat().st_size // (self.dim * 4)
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM embeddings WHERE ns = ?", (self.namespace,)).fetchone()[0]
+
+    def orphan_ratio(self) -> float:
+        """
+        无索引引用的行占比
+        """
+        rows = self.rows
+        return (rows - len(self)) / rows if rows else 0.0
+
+    def _view(self, rows: int) -> Optional[np.memmap]:
+        """
+        获取覆盖至少 `rows` 行的内存映射（文件增长后重新映射）
+        """
+        if self._matrix is None or self._matrix.shape[0] < rows:
+            total = self.rows
+            if total < rows:
+                return None
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(total, self.dim))
+        return self._matrix
+
+    def _lookup_rows(self, keys: Sequence[str]) -> dict[str, int]:
+        found: dict[str, int] = {}
+        for i in range(0, len(keys), _SQL_BATCH):
+            batch = keys[i : i + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            found.update(
+                self._db.execute(
+                    f"SELECT key, row FROM embeddings WHERE ns = ? AND key IN ({placeholders})",
+                    (self.namespace, *batch),
+                ).fetchall()
+            )
+        return found
+
+    def get_many(self, texts: Sequence[str]) -> list[Optional[ndarray]]:
+        """
+        批量查询嵌入向量
+
+        :return: 与 `texts` 一一对应的只读向量视图，未命中为 None
+        """
+        if not self.dim or not texts:
+            return [None] * len(texts)
+
+        keys = [text_key(text) for text in texts]
+        found = self._lookup_rows(keys)
+        matrix = self._view(max(found.values()) + 1) if found else None
+        if matrix is None:
+            return [None] * len(texts)
+
+        return [matrix[found[key]] if key in found else None for key in keys]
+
+    def get(self, text: str) -> Optional[ndarray]:
+        """
+        查询单个嵌入向量
+        """
+        return self.get_many([text])[0]
+
+    def put_many(self, texts: Sequence[str], embeddings: Iterable[Sequence[float]]):
+        """
+        批量写入嵌入向量（已存在的文本将被忽略）
+        """
+        self._append([text_key(text) for text in texts], np.asarray(list(embeddings), dtype=np.float32))
+
+    def remove(self, texts: Sequence[str]):
+        """
+        移除嵌入向量的索引（矩阵中的行在压缩时回收）
+        """
+        keys = [text_key(text) for text in texts]
+        for i in range(0, len(keys), _SQL_BATCH):
+            batch = keys[i : i + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            self._db.execute(
+                f"DELETE FROM embeddings WHERE ns = ? AND key IN ({placeholders})", (self.namespace, *batch)
+            )
+        self._db.commit()
+
+    def compact(self):
+        """
+        重写矩阵文件，仅保留仍被索引引用的行
+
+        压缩后此前返回的向量视图将失效，因此只应在没有向量视图被使用时调用（例如打开存储时）
+        """
+        entries = self._db.execute(
+            "SELECT key, row FROM embeddings WHERE ns = ? ORDER BY row", (self.namespace,)
+        ).fetchall()
+        self._matrix = None
+
+        tmp_path = self.matrix_path.with_name(f"{self.matrix_path.name}.tmp")
+        if entries:
+            source = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+            with open(tmp_path, "wb") as f:
+                for i in range(0, len(entries), _SQL_BATCH):
+                    f.write(np.ascontiguousarray(source[[row for _, row in entries[i : i + _SQL_BATCH]]]).tobytes())
+            del source
+        else:
+            tmp_path.write_bytes(b"")
+
+        os.replace(tmp_path, self.matrix_path)
+        self._db.executemany(
+            "UPDATE embeddings SET row = ? WHERE ns = ? AND key = ?",
+            [(row, self.namespace, key) for row, (key, _) in enumerate(entries)],
+        )
+        self._db.commit()
+        logger.info(f"嵌入缓存压缩完成: {self.namespace}，保留 {len(entries)} 条")
+
+    def import_legacy(self, directory: Path, provider: str, api_host: str, model: str) -> int:
+        """
+        导入旧版逐文本存储的缓存文件（`<md5>.json` 与 `<md5>.npy`），导入后删除旧文件
+
+        :return: 导入的向量数
+        """
+        keys: list[str] = []
+        vectors: list[ndarray] = []
+        imported_files: list[Path] = []
+
+        for meta_path in directory.glob("*.json"):
+            npy_path = meta_path.with_suffix(".npy")
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if not (
+                    isinstance(meta, dict)
+                    and meta.get("provider") == provider
+                    and meta.get("api_host") == api_host
+                    and meta.get("model") == model
+                    and npy_path.exists()
+                ):
+                    continue
+                keys.append(meta["text_hash"])
+                vectors.append(np.load(npy_path))
+                imported_files.extend([meta_path, npy_path])
+            except Exception as e:
+                logger.warning(f"读取旧版嵌入缓存 {meta_path.name} 失败: {e}")
+
+        if not keys:
+            return 0
+
+        # 旧版缓存只保存了文本哈希，这里直接以哈希作为索引键写入
+        shapes = {vector.shape for vector in vectors}
+        if len(shapes) != 1:
+            logger.warning("旧版嵌入缓存的向量维度不一致，跳过导入")
+            return 0
+        self._append(keys, np.asarray(vectors, dtype=np.float32))
+        for path in imported_files:
+            path.unlink(missing_ok=True)
+
+        logger.info(f"已导入 {len(keys)} 条旧版嵌入缓存")
+        return len(keys)
+
+    def _append(self, keys: Sequence[str], vectors: ndarray):
+        """
+        将向量追加到矩阵末尾并写入索引（已存在或重复的键将被忽略）
+        """
+        if vectors.ndim != 2 or len(vectors) != len(keys):
+            return
+
+        if not self.dim:
+            self.dim = vectors.shape[1]
+            self._db.execute("INSERT OR REPLACE INTO matrices (ns, dim) VALUES (?, ?)", (self.namespace, self.dim))
+        elif vectors.shape[1] != self.dim:
+            logger.warning(f"嵌入向量维度 ({vectors.shape[1]}) 与缓存 ({self.dim}) 不一致，跳过缓存")
+            return
+
+        existing = self._lookup_rows(keys)
+        new: dict[str, int] = {}
+        for index, key in enumerate(keys):
+            if key not in existing and key not in new:
+                new[key] = index
+        if not new:
+            self._db.commit()
+            return
+
+        start = self.rows
+        with open(self.matrix_path, "ab") as f:
+            f.truncate(start * self.dim * 4)  # 丢弃中断写入遗留的不完整行，保证新行按行号对齐
+            f.write(vectors[list(new.values())].tobytes())
+
+        self._db.executemany(
+            "INSERT OR IGNORE INTO embeddings (ns, key, row) VALUES (?, ?, ?)",
+            [(self.namespace, key, start + offset) for offset, key in enumerate(new)],
+        )
+        self._db.commit()
+
+    def close(self):
+        """
+        释放内存映射并关闭索引数据库连接
+        """
+        self._matrix = None
+        self._db.close()
@@ -73,3 +73,12 @@ class EmbeddingsBatchResult:
         from numpy import array
 
         return [array(embedding) for embedding in self.embeddings]
+
+    @property
+    def matrix(self) -> "ndarray":
+        """
+        以连续的 float32 二维数组（每行一个嵌入向量）返回嵌入结果
+        """
+        from numpy import asarray, float32
+
+        return asarray(self.embeddings, dtype=float32)
@@ -0,0 +1,288 @@
+"""
+嵌入向量索引：为检索类插件提供进程内的 top-k 相似度搜索
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Union
+
+import numpy as np
+from numpy import ndarray
+
+VectorsLike = Union[ndarray, Sequence[float], Sequence[Sequence[float]]]
+
+_INITIAL_CAPACITY = 1024
+_INT8_SEARCH_BLOCK = 65536
+"""int8 量化索引搜索时每次反量化的行数，用于限制临时内存占用"""
+
+
+def _normalize(vectors: ndarray) -> ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """
+    基于余弦相似度的向量索引
+
+    向量在写入时归一化并存储于连续的 float32（或 int8 量化）矩阵中，搜索时通过批量矩阵乘法与 `argpartition` 取得 top-k。
+    增删均为增量操作：删除时以末行填补空位，矩阵始终保持连续。
+
+    只应在单个线程中使用（非线程安全）
+
+    示例::
+
+        model = load_embedding_model(config)
+        result = await model.embed(texts)
+        index = VectorIndex()
+        index.add(ids, result.embeddings)
+        hits = index.search(query_embedding, k=5)
+    """
+
+    def __init__(self, dim: Optional[int] = None, quantize: bool = False) -> None:
+        """
+        :param dim: (可选)向量维度，为 None 时由首次写入的向量确定
+        :param quantize: 是否以 int8 量化存储向量（内存占用约为 float32 的 1/4，相似度存在少量误差）
+        """
+        self.dim = dim
+        """向量维度"""
+        self.quantize = quantize
+        """是否以 int8 量化存储"""
+
+        self._ids: list[str] = []
+        self._rows: dict[str, int] = {}
+        self._vectors: ndarray = np.empty((0, dim or 0), dtype=np.int8 if quantize else np.float32)
+        self._scales: ndarray = np.empty(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._rows
+
+    @property
+    def ids(self) -> list[str]:
+        """
+        按存储顺序排列的向量 ID
+        """
+        return list(self._ids)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        向量矩阵占用的内存大小
+        """
+        return self._vectors.nbytes + self._scales.nbytes
+
+    def _prepare(self, vectors: VectorsLike) -> ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        if matrix.ndim != 2:
+            raise ValueError("向量必须为一维或二维数组")
+
+        if self.dim is None or self.dim == 0:
+            self.dim = matrix.shape[1]
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"向量维度 ({matrix.shape[1]}) 与索引维度 ({self.dim}) 不一致")
+
+        return _normalize(matrix)
+
+    def _encode(self, matrix: ndarray) -> tuple[ndarray, ndarray]:
+        """
+        将归一化后的向量编码为存储格式，返回 (编码后的向量, 每行缩放系数)
+        """
+        if not self.quantize:
+            return matrix, np.ones(len(matrix), dtype=np.float32)
+
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _reserve(self, rows: int):
+        capacity = self._vectors.shape[0]
+        if rows <= capacity and self._vectors.shape[1] == self.dim:
+            return
+
+        capacity = max(capacity * 2, rows, _INITIAL_CAPACITY)
+        vectors = np.empty((capacity, self.dim or 0), dtype=self._vectors.dtype)
+        scales = np.empty(capacity, dtype=np.float32)
+        size = len(self._ids)
+        if size:
+            vectors[:size] = self._vectors[:size]
+            scales[:size] = self._scales[:size]
+        self._vectors, self._scales = vectors, scales
+
+    def add(self, ids: Sequence[str], vectors: VectorsLike):
+        """
+        添加或更新向量
+
+        :param ids: 向量 ID 列表，已存在的 ID 将覆盖原有向量
+        :param vectors: 与 `ids` 一一对应的嵌入向量（如 `EmbeddingsBatchResult.embeddings`）
+        """
+        matrix = self._prepare(vectors)
+        if len(matrix) != len(ids):
+            raise ValueError(f"ID 数量 ({len(ids)}) 与向量数量 ({len(matrix)}) 不一致")
+
+        codes, scales = self._encode(matrix)
+        self._reserve(len(self._ids) + len(ids))
+
+        for id, code, scale in zip(ids, codes, scales):
+            row = self._rows.get(id)
+            if row is None:
+                row = len(self._ids)
+                self._ids.append(id)
+                self._rows[id] = row
+            self._vectors[row] = code
+            self._scales[row] = scale
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """
+        删除向量
+
+        :return: 实际删除的向量数
+        """
+        removed = 0
+        for id in ids:
+            row = self._rows.pop(id, None)
+            if row is None:
+                continue
+
+            last = len(self._ids) - 1
+            if row != last:
+                moved = self._ids[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+                self._vectors[row] = self._vectors[last]
+                self._scales[row] = self._scales[last]
+            self._ids.pop()
+            removed += 1
+
+        return removed
+
+    def clear(self):
+        """
+        清空索引
+        """
+        self._ids.clear()
+        self._rows.clear()
+        self._vectors = np.empty((0, self.dim or 0), dtype=self._vectors.dtype)
+        self._scales = np.empty(0, dtype=np.float32)
+
+    def get(self, id: str) -> Optional[ndarray]:
+        """
+        获取已归一化的向量（int8 量化索引返回反量化后的近似值）
+        """
+        row = self._rows.get(id)
+        if row is None:
+            return None
+        return self._vectors[row].astype(np.float32) * self._scales[row]
+
+    def _scores(self, queries: ndarray) -> Iterable[tuple[int, ndarray]]:
+        """
+        分块计算查询向量与索引中所有向量的余弦相似度，返回 (起始行, 相似度矩阵)
+        """
+        size = len(self._ids)
+        if not self.quantize:
+            # 以 (行数 x 维度) @ (维度 x 查询数) 的顺序相乘，对单个或少量查询时访存更连续
+            yield 0, (self._vectors[:size] @ queries.T).T
+            return
+
+        for start in range(0, size, _INT8_SEARCH_BLOCK):
+            end = min(start + _INT8_SEARCH_BLOCK, size)
+            block = self._vectors[start:end].astype(np.float32)
+            yield start, (block @ queries.T).T * self._scales[start:end]
+
+    def search_batch(
+        self, queries: VectorsLike, k: int = 10, min_score: Optional[float] = None
+    ) -> list[list[tuple[str, float]]]:
+        """
+        批量搜索与查询向量最相似的向量
+
+        :param queries: 查询向量（一维或二维）
+        :param k: 每个查询返回的最大结果数
+        :param min_score: (可选)最低相似度，低于该值的结果将被过滤
+
+        :return: 每个查询对应的 (向量 ID, 余弦相似度) 列表，按相似度降序排列
+        """
+        matrix = self._prepare(queries)
+        if not self._ids or k <= 0:
+            return [[] for _ in range(len(matrix))]
+
+        candidate_rows: list[ndarray] = []
+        candidate_scores: list[ndarray] = []
+        for start, scores in self._scores(matrix):
+            top = min(k, scores.shape[1])
+            rows = np.argpartition(scores, scores.shape[1] - top, axis=1)[:, -top:]
+            candidate_rows.append(rows + start)
+            candidate_scores.append(np.take_along_axis(scores, rows, axis=1))
+
+        all_rows = np.concatenate(candidate_rows, axis=1)
+        all_scores = np.concatenate(candidate_scores, axis=1)
+        top = min(k, all_scores.shape[1])
+        if top < all_scores.shape[1]:
+            selected = np.argpartition(all_scores, all_scores.shape[1] - top, axis=1)[:, -top:]
+            all_rows = np.take_along_axis(all_rows, selected, axis=1)
+            all_scores = np.take_along_axis(all_scores, selected, axis=1)
+
+        order = np.argsort(-all_scores, axis=1)
+        all_rows = np.take_along_axis(all_rows, order, axis=1)
+        all_scores = np.take_along_axis(all_scores, order, axis=1)
+
+        results: list[list[tuple[str, float]]] = []
+        for rows, scores in zip(all_rows.tolist(), all_scores.tolist()):
+            results.append(
+                [(self._ids[row], score) for row, score in zip(rows, scores) if min_score is None or score >= min_score]
+            )
+        return results
+
+    def search(self, query: VectorsLike, k: int = 10, min_score: Optional[float] = None) -> list[tuple[str, float]]:
+        """
+        搜索与查询向量最相似的向量
+
+        :param query: 查询向量
+        :param k: 返回的最大结果数
+        :param min_score: (可选)最低相似度，低于该值的结果将被过滤
+
+        :return: (向量 ID, 余弦相似度) 列表，按相似度降序排列
+        """
+        return self.search_batch(query, k, min_score)[0]
+
+    def save(self, path: Union[str, Path]):
+        """
+        将索引保存到文件（`.npz` 格式，先写入临时文件再替换，避免写入中断损坏原文件）
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = len(self._ids)
+
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self._ids, dtype=str),
+                vectors=self._vectors[:size],
+                scales=self._scales[:size],
+                dim=np.array(self.dim or 0),
+                quantize=np.array(self.quantize),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "VectorIndex":
+        """
+        从文件加载索引
+        """
+        with np.load(Path(path), allow_pickle=False) as data:
+            index = cls(dim=int(data["dim"]) or None, quantize=bool(data["quantize"]))
+            ids = [str(id) for id in data["ids"]]
+            index._ids = ids
+            index._rows = {id: row for row, id in enumerate(ids)}
+            index._vectors = np.ascontiguousarray(data["vectors"])
+            index._scales = np.ascontiguousarray(data["scales"], dtype=np.float32)
+
+        return index
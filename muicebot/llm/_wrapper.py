@@ -1,19 +1,22 @@
 from __future__ import annotations
 
 import asyncio
+from contextvars import ContextVar
+from dataclasses import replace
 from functools import wraps
 from typing import TYPE_CHECKING, AsyncGenerator, Awaitable, Callable, TypeAlias, Union
 
-from nonebot_plugin_orm import get_scoped_session
-
-from ..database.crud import UsageORM
+from ..database import usage_aggregator
 from ..plugin.loader import _get_caller_plugin_name
+from ._cache import CacheLookup, get_completion_cache, request_keys
+from ._coalesce import request_coalescer
 from ._schema import (
     EmbeddingsBatchResult,
     ModelCompletions,
     ModelRequest,
     ModelStreamCompletions,
 )
+from .utils.images import prefetch_file_base64, preprocess_images
 
 if TYPE_CHECKING:
     from ._base import BaseLLM, EmbeddingModel
@@ -21,7 +24,8 @@ if TYPE_CHECKING:
 ASK_FUNC: TypeAlias = Callable[..., Awaitable[Union[ModelCompletions, AsyncGenerator[ModelStreamCompletions, None]]]]
 EMBED_FUNC: TypeAlias = Callable[..., Awaitable[EmbeddingsBatchResult]]
 
-_usage_write_lock = asyncio.Lock()
+_embedding_caller: ContextVar[str | None] = ContextVar("_embedding_caller", default=None)
+"""发起嵌入查询的插件名（分批查询在独立任务中进行，无法从调用栈中获取）"""
 
 
 def record_plugin_usage(func: ASK_FUNC):
@@ -40,10 +44,7 @@ def record_plugin_usage(func: ASK_FUNC):
         if isinstance(response, ModelCompletions):
             total_usage = response.usage if response.usage > 0 else 0
 
-            async with _usage_write_lock:
-                session = get_scoped_session()
-                await UsageORM.save_usage(session, plugin_name, total_usage)
-
+            usage_aggregator.add(plugin_name, total_usage)
             return response
 
         # Handle streaming response
@@ -58,15 +59,129 @@ def record_plugin_usage(func: ASK_FUNC):
                     total_usage = chunk.usage if chunk.usage > 0 else 0
                     yield chunk
             finally:
-                async with _usage_write_lock:
-                    session = get_scoped_session()
-                    await UsageORM.save_usage(session, plugin_name, total_usage)
+                await response.aclose()
+                usage_aggregator.add(plugin_name, total_usage)
 
         return generator_wrapper()
 
     return wrapper
 
 
+def cache_completions(func: ASK_FUNC):
+    """
+    模型回复缓存的装饰器
+
+    命中时直接返回（或流式重放）缓存的回复，用量记为 0，并在 `Usage` 中记录命中次数（`cache_hit`）与节省的用量（`cache_saved`）
+    """
+
+    @wraps(func)
+    async def wrapper(self: "BaseLLM", request: ModelRequest, *, stream: bool = False):
+        completion_cache = get_completion_cache()
+        if not self.config.enable_completion_cache or completion_cache.bypass(request, self.config):
+            return await func(self, request, stream=stream)
+
+        lookup = await completion_cache.lookup(request, self.config)
+        if lookup.completions is not None:
+            plugin_name = _get_caller_plugin_name() or "muicebot"
+            usage_aggregator.add(plugin_name, 1, "cache_hit")
+            usage_aggregator.add(plugin_name, lookup.saved_usage, "cache_saved")
+            return _replay(lookup.completions) if stream else lookup.completions
+
+        response = await func(self, request, stream=stream)
+        if isinstance(response, ModelCompletions):
+            completion_cache.store(lookup, response, self.config.completion_cache_ttl)
+            return response
+
+        return _capture(response, lookup, self.config.completion_cache_ttl)
+
+    return wrapper
+
+
+async def _replay(completions: ModelCompletions) -> AsyncGenerator[ModelStreamCompletions, None]:
+    """
+    以流式输出重放缓存的回复
+    """
+    for line in completions.text.splitlines(keepends=True):
+        yield ModelStreamCompletions(chunk=line, usage=0)
+    if completions.resources:
+        yield ModelStreamCompletions(usage=0, resources=completions.resources)
+
+
+async def _capture(
+    response: AsyncGenerator[ModelStreamCompletions, None], lookup: CacheLookup, ttl: float
+) -> AsyncGenerator[ModelStreamCompletions, None]:
+    """
+    透传流式输出，并在完整输出且全部成功后写入缓存
+    """
+    completions = ModelCompletions(text="", usage=0)
+    chunks: list[str] = []
+
+    try:
+        async for chunk in response:
+            if not chunk.succeed:
+                completions.succeed = False
+            chunks.append(chunk.chunk)
+            completions.resources.extend(chunk.resources or [])
+            completions.usage = max(completions.usage, chunk.usage)
+            yield chunk
+    finally:
+        await response.aclose()
+
+    completions.text = "".join(chunks)
+    if completions.text or completions.resources:
+        get_completion_cache().store(lookup, completions, ttl)
+
+
+def coalesce_requests(func: ASK_FUNC):
+    """
+    合并并发的相同请求的装饰器（带有工具的请求可能依赖调用者的上下文，不参与合并）
+    """
+
+    @wraps(func)
+    async def wrapper(self: "BaseLLM", request: ModelRequest, *, stream: bool = False):
+        if not self.config.enable_request_coalescing or request.tools:
+            return await func(self, request, stream=stream)
+
+        key = f"{id(self)}:{stream}:{request_keys(request, self.config)[0]}"
+        if stream:
+            return await request_coalescer.stream(key, lambda: func(self, request, stream=True))  # type: ignore
+        return await request_coalescer.call(key, lambda: func(self, request, stream=False))  # type: ignore
+
+    return wrapper
+
+
+def prepare_resources(func: ASK_FUNC):
+    """
+    在调用模型前预处理图片，并于线程池中预先编码请求中的多模态文件的装饰器
+    """
+
+    @wraps(func)
+    async def wrapper(self: "BaseLLM", request: ModelRequest, *, stream: bool = False):
+        if self.config.image_max_edge > 0:
+            request = replace(
+                request,
+                resources=await preprocess_images(request.resources, self.config),
+                history=[
+                    (
+                        replace(item, resources=await preprocess_images(item.resources, self.config))
+                        if item.resources
+                        else item
+                    )
+                    for item in request.history
+                ],
+            )
+
+        resources = list(request.resources)
+        if self.config.multimodal:
+            resources.extend(resource for item in request.history for resource in item.resources)
+
+        await prefetch_file_base64(resource.path for resource in resources if resource.path)
+
+        return await func(self, request, stream=stream)
+
+    return wrapper
+
+
 def record_plugin_embedding_usage(func: EMBED_FUNC):
     """
     记录插件嵌入用量的装饰器
@@ -74,13 +189,12 @@ def record_plugin_embedding_usage(func: EMBED_FUNC):
 
     @wraps(func)
     async def wrapper(self: "EmbeddingModel", texts: list[str]):
-        plugin_name = _get_caller_plugin_name() or "muicebot"
+        plugin_name = _embedding_caller.get() or _get_caller_plugin_name() or "muicebot"
         result = await func(self, texts)
 
-        if result.succeed and result.usage > 0:
-            async with _usage_write_lock:
-                session = get_scoped_session()
-                await UsageORM.save_usage(session, plugin_name, result.usage, "embedding")
+        # 失败的调用同样可能已产生计费用量
+        if result.usage > 0:
+            usage_aggregator.add(plugin_name, result.usage, "embedding")
 
         return result
 
@@ -90,22 +204,54 @@ def record_plugin_embedding_usage(func: EMBED_FUNC):
 def cache(func: EMBED_FUNC):
     """
     缓存嵌入向量的装饰器
+
+    先从缓存中取出已有的嵌入，其余（去重后的）文本按模型的批大小分批、有限并发地查询，结果按原顺序返回
     """
 
     @wraps(func)
     async def wrapper(self: "EmbeddingModel", texts: list[str]):
-        if not self.enable_embedding_cache:
-            return await func(self, texts)
-
-        results = []
-        for text in texts:
-            embedding = self._load_embedding_from_cache(text)
-            if embedding is not None:
-                results.append(embedding)
+        results: list = [None] * len(texts)
+        misses: dict[str, list[int]] = {}
+
+        for index, (text, cached) in enumerate(zip(texts, self._load_embeddings_from_cache(texts))):
+            if cached is not None:
+                results[index] = cached
             else:
-                result = await func(self, [text])
-                self._save_to_cache(text, result.embeddings[0])
-                results.append(result.embeddings[0])
-        return EmbeddingsBatchResult(succeed=True, embeddings=results)
+                misses.setdefault(text, []).append(index)
+
+        if not misses:
+            return EmbeddingsBatchResult(succeed=True, embeddings=results, usage=0)
+
+        pending = list(misses)
+        batch_size = max(self.config.batch_size or self.max_batch_size, 1)
+        batches = [pending[i : i + batch_size] for i in range(0, len(pending), batch_size)]
+        semaphore = asyncio.Semaphore(max(self.config.max_concurrency, 1))
+
+        async def _embed_batch(batch: list[str]) -> EmbeddingsBatchResult:
+            async with semaphore:
+                return await func(self, batch)
+
+        token = _embedding_caller.set(_embedding_caller.get() or _get_caller_plugin_name())
+        try:
+            batch_results = await asyncio.gather(*(_embed_batch(batch) for batch in batches))
+        finally:
+            _embedding_caller.reset(token)
+
+        # 用量按所有批次累计（包括失败的批次），成功的批次照常写入缓存
+        usage = sum(max(result.usage, 0) for result in batch_results)
+        succeed = True
+        for batch, result in zip(batches, batch_results):
+            if not result.succeed or len(result.embeddings) != len(batch):
+                succeed = False
+                continue
+
+            self._save_embeddings_to_cache(batch, result.embeddings)
+            for text, embedding in zip(batch, result.embeddings):
+                for index in misses[text]:
+                    results[index] = embedding
+
+        if not succeed:
+            return EmbeddingsBatchResult(succeed=False, embeddings=[], usage=usage)
+        return EmbeddingsBatchResult(succeed=True, embeddings=results, usage=usage)
 
     return wrapper
@@ -1,5 +1,6 @@
 import base64
 import struct
+from typing import Optional
 
 from azure.ai.inference.aio import EmbeddingsClient
 from azure.core.credentials import AzureKeyCredential
@@ -12,19 +13,34 @@ from ..registry import register
 
 @register("azure")
 class Azure(EmbeddingModel):
+    max_batch_size = 256
+
     def __init__(self, config: EmbeddingConfig):
         super().__init__(config)
         self.token = self.config.api_key
         self.endpoint = self.config.api_host if self.config.api_host else "https://models.inference.ai.azure.com"
         self.model = self.config.model
+        self._client: Optional[EmbeddingsClient] = None
+
+    def _get_client(self) -> EmbeddingsClient:
+        """
+        获取复用的客户端（连接池在多次请求间共享）
+        """
+        if self._client is None:
+            self._client = EmbeddingsClient(endpoint=self.endpoint, credential=AzureKeyCredential(self.token))
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        await super().close()
 
     async def embed(self, texts: list[str]) -> EmbeddingsBatchResult:
         """
         查询文本嵌入
         """
-        client = EmbeddingsClient(endpoint=self.endpoint, credential=AzureKeyCredential(self.token))
-
-        response = await client.embed(input=texts, model=self.model)
+        response = await self._get_client().embed(input=texts, model=self.model)
         results: list[list[float]] = []
 
         for item in response.data:
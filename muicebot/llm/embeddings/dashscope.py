@@ -11,6 +11,9 @@ from ..registry import register
 
 @register("dashscope")
 class Dashscope(EmbeddingModel):
+    max_batch_size = 10
+    """text-embedding-v3/v4 单次最多接受 10 条输入"""
+
     def __init__(self, config: EmbeddingConfig):
         super().__init__(config)
         self._require("api_key")
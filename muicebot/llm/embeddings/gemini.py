@@ -8,6 +8,9 @@ from ..registry import register
 
 @register("gemini")
 class Gemini(EmbeddingModel):
+    max_batch_size = 100
+    """单次最多接受 100 条输入"""
+
     def __init__(self, config: EmbeddingConfig):
         super().__init__(config)
         self._require("api_key", "model")
@@ -8,6 +8,9 @@ from ..registry import register
 
 @register("openai")
 class OpenAI(EmbeddingModel):
+    max_batch_size = 512
+    """OpenAI 单次最多接受 2048 条输入，同时受单次请求总 Token 数限制"""
+
     def __init__(self, config: EmbeddingConfig):
         super().__init__(config)
         self._require("api_key")
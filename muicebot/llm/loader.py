@@ -44,3 +44,12 @@ def load_embedding_model(config: EmbeddingConfig) -> EmbeddingModel:
     EmbeddingClass = get_embedding_class(provider)
 
     return _embedding_instance.setdefault(config, EmbeddingClass(config))
+
+
+async def close_embedding_models():
+    """
+    关闭所有已缓存的嵌入模型实例
+    """
+    for model in _embedding_instance.values():
+        await model.close()
+    _embedding_instance.clear()
@@ -51,6 +51,25 @@ class Azure(BaseLLM):
         self.presence_penalty = self.config.presence_penalty
         self.token = os.getenv("AZURE_API_KEY", self.config.api_key)
         self.endpoint = self.config.api_host if self.config.api_host else "https://models.inference.ai.azure.com"
+        self._client: Optional[ChatCompletionsClient] = None
+
+    def _get_client(self) -> ChatCompletionsClient:
+        """
+        获取复用的客户端（连接池在多次请求间共享）
+        """
+        if self._client is None:
+            self._client = ChatCompletionsClient(endpoint=self.endpoint, credential=AzureKeyCredential(self.token))
+        return self._client
+
+    def load(self) -> bool:
+        self._get_client()
+        return super().load()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        await super().close()
 
     def __build_multi_messages(self, request: ModelRequest) -> UserMessage:
         """
@@ -138,7 +157,7 @@ class Azure(BaseLLM):
         response_format: Optional[JsonSchemaFormat],
         total_tokens: int = 0,
     ) -> ModelCompletions:
-        client = ChatCompletionsClient(endpoint=self.endpoint, credential=AzureKeyCredential(self.token))
+        client = self._get_client()
 
         completions = ModelCompletions()
         current_total_tokens = total_tokens
@@ -201,7 +220,6 @@ class Azure(BaseLLM):
             completions.text = f"模型响应失败: {e.status_code} ({e.reason})"
 
         finally:
-            await client.close()
             completions.usage = current_total_tokens
             return completions
 
@@ -212,7 +230,7 @@ class Azure(BaseLLM):
         response_format: Optional[JsonSchemaFormat],
         total_tokens: int = 0,
     ) -> AsyncGenerator[ModelStreamCompletions, None]:
-        client = ChatCompletionsClient(endpoint=self.endpoint, credential=AzureKeyCredential(self.token))
+        client = self._get_client()
         current_total_tokens = total_tokens
 
         try:
@@ -301,9 +319,6 @@ class Azure(BaseLLM):
             stream_completions.succeed = False
             yield stream_completions
 
-        finally:
-            await client.close()
-
     @overload
     async def ask(self, request: ModelRequest, *, stream: Literal[False] = False) -> ModelCompletions: ...
 
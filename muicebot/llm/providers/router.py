@@ -0,0 +1,332 @@
+"""
+多端点路由：按延迟选择端点，超过 p95 延迟时发起对冲请求（先返回者胜出，其余取消），并对失败的端点熔断与自动降级
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, List, Literal, Optional, Union, overload
+
+from nonebot import logger
+
+from .. import (
+    BaseLLM,
+    ModelCompletions,
+    ModelConfig,
+    ModelRequest,
+    ModelStreamCompletions,
+    load_model,
+    register,
+)
+
+_EWMA_ALPHA = 0.3
+_LATENCY_WINDOW = 64
+_MIN_HEDGE_SAMPLES = 5
+
+
+class Endpoint:
+    """
+    路由中的单个模型端点，记录其延迟与熔断状态
+    """
+
+    def __init__(self, name: str, model: BaseLLM, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.ewma: Optional[float] = None
+        """延迟的指数加权移动平均（秒）"""
+        self.latencies: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        """最近的成功请求延迟（秒）"""
+        self.failures = 0
+        """连续失败次数"""
+        self.opened_at: Optional[float] = None
+        """熔断时间，为空表示未熔断"""
+        self.probing = False
+        """熔断期间是否已有试探请求进行中"""
+
+    @property
+    def available(self) -> bool:
+        """
+        端点是否可用（未熔断，或熔断已超过重置时间而进入半开状态且没有进行中的试探请求）
+        """
+        if self.opened_at is None:
+            return True
+        return time.monotonic() - self.opened_at >= self.reset_timeout and not self.probing
+
+    def acquire(self) -> Optional[bool]:
+        """
+        获取发起请求的许可：熔断期间同一时间只允许一个试探请求，其余请求视为熔断
+
+        :return: 未熔断时返回 False，获得试探许可时返回 True，已有试探请求进行中时返回 None
+        """
+        if self.opened_at is None:
+            return False
+        if self.probing:
+            return None
+        self.probing = True
+        return True
+
+    def p95(self) -> Optional[float]:
+        """
+        最近请求延迟的 p95，样本不足时返回 None
+        """
+        if len(self.latencies) < _MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _observe(self, latency: float):
+        self.ewma = latency if self.ewma is None else _EWMA_ALPHA * latency + (1 - _EWMA_ALPHA) * self.ewma
+
+    def record_cancelled(self, elapsed: float):
+        """
+        记录对冲失利而被取消的请求：其实际延迟至少为已等待的时间
+        """
+        self._observe(max(elapsed, self.ewma or 0.0))
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self._observe(latency)
+        self.failures = 0
+        if self.opened_at is not None:
+            logger.info(f"路由端点 {self.name} 已恢复")
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        # 半开状态下的试探请求失败时重新熔断
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            if self.opened_at is None:
+                logger.warning(f"路由端点 {self.name} 连续失败 {self.failures} 次，已熔断")
+            self.opened_at = time.monotonic()
+
+
+@register("router")
+class Router(BaseLLM):
+    """
+    组合多个模型配置的路由提供者
+
+    调用时选择延迟最低的可用端点；若超过对冲等待时间仍未响应，则向下一个端点发起相同请求，先成功返回者胜出；
+    端点失败时立即切换到下一个端点。流式请求以首个输出块为准，开始输出后不再切换
+    """
+
+    preprocess_resources = False
+    """多模态资源由实际调用的端点按其自身配置预处理"""
+
+    def __init__(self, model_config: ModelConfig) -> None:
+        super().__init__(model_config)
+        self._require("routes")
+
+        self.endpoints: List[Endpoint] = []
+        """路由端点，按配置的优先级排序"""
+
+    def _resolve_route(self, route: Union[str, dict]) -> tuple[str, ModelConfig]:
+        if isinstance(route, dict):
+            config = ModelConfig(**route)
+            return config.model_name or config.provider, config
+
+        from ...config import get_model_config
+
+        return route, get_model_config(route)
+
+    def load(self) -> bool:
+        if self.endpoints:
+            # 重新加载时关闭原有端点，避免重复添加
+            self._close_endpoints(self.endpoints)
+            self.endpoints = []
+
+        for route in self.config.routes:
+            try:
+                name, config = self._resolve_route(route)
+                if config.provider == "router":
+                    raise ValueError("路由端点不能是另一个路由")
+                model = load_model(config)
+                if not model.load():
+                    raise RuntimeError("模型加载失败")
+            except Exception as e:
+                logger.error(f"加载路由端点 {route} 失败: {e}")
+                continue
+
+            self.endpoints.append(
+                Endpoint(name, model, self.config.circuit_failure_threshold, self.config.circuit_reset_timeout)
+            )
+
+        self.is_running = bool(self.endpoints)
+        return self.is_running
+
+    @staticmethod
+    def _close_endpoints(endpoints: List[Endpoint]):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for endpoint in endpoints:
+            loop.create_task(endpoint.model.close())
+
+    async def close(self) -> None:
+        await asyncio.gather(*(endpoint.model.close() for endpoint in self.endpoints), return_exceptions=True)
+        self.endpoints.clear()
+        await super().close()
+
+    def _select(self) -> List[Endpoint]:
+        """
+        获取本次请求的候选端点：可用端点按延迟升序（尚无样本的端点优先试探），同延迟时按配置优先级；
+        全部熔断时仍按优先级尝试所有没有进行中试探请求的端点
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.available] or [
+            endpoint for endpoint in self.endpoints if not endpoint.probing
+        ]
+        return sorted(candidates, key=lambda endpoint: endpoint.ewma or 0.0)
+
+    def _hedge_delay(self, endpoint: Endpoint) -> Optional[float]:
+        if self.config.hedge_delay is not None:
+            return self.config.hedge_delay or None
+        return endpoint.p95()
+
+    async def _attempt(self, endpoint: Endpoint, request: ModelRequest, stream: bool, probe: bool) -> Any:
+        """
+        向单个端点发起请求，失败时抛出异常
+
+        :param probe: 是否为熔断期间的试探请求（结束后释放试探许可）
+
+        :return: 非流式请求返回 `ModelCompletions`；流式请求返回 (首个输出块, 输出生成器)
+        """
+        # 缓存、合并与用量记录已在路由层完成，端点只需按自身配置预处理资源
+        ask = type(endpoint.model)._provider_ask
+        start = time.monotonic()
+
+        async def _request() -> Any:
+            if not stream:
+                completions = await ask(endpoint.model, request, stream=False)
+                if not completions.succeed:
+                    raise RuntimeError(completions.text)
+                return completions
+
+            generator = await ask(endpoint.model, request, stream=True)
+            try:
+                first = await generator.__anext__()
+            except StopAsyncIteration:
+                first = ModelStreamCompletions()
+            except BaseException:
+                await generator.aclose()
+                raise
+            if not first.succeed:
+                await generator.aclose()
+                raise RuntimeError(first.chunk)
+            return first, generator
+
+        try:
+            result = await asyncio.wait_for(_request(), self.config.route_timeout or None)
+        except asyncio.CancelledError:
+            endpoint.record_cancelled(time.monotonic() - start)
+            raise
+        except Exception as e:
+            endpoint.record_failure()
+            logger.warning(f"路由端点 {endpoint.name} 请求失败: {e or type(e).__name__}")
+            raise
+        finally:
+            if probe:
+                endpoint.probing = False
+
+        endpoint.record_success(time.monotonic() - start)
+        return result
+
+    async def _race(self, request: ModelRequest, stream: bool) -> Any:
+        """
+        依次（或对冲地）向候选端点发起请求，返回首个成功的结果
+        """
+        candidates = self._select()
+        tasks: dict[asyncio.Task, Endpoint] = {}
+        last_error: Optional[BaseException] = None
+
+        def _launch() -> Optional[Endpoint]:
+            # 跳过在选择之后已被其他请求占用试探许可的熔断端点
+            while candidates:
+                endpoint = candidates.pop(0)
+                probe = endpoint.acquire()
+                if probe is None:
+                    continue
+                tasks[asyncio.create_task(self._attempt(endpoint, request, stream, probe))] = endpoint
+                return endpoint
+            return None
+
+        current = _launch()
+        if current is None:
+            raise RuntimeError("所有路由端点均已熔断")
+
+        try:
+            while tasks:
+                delay = self._hedge_delay(current) if candidates else None
+                done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedge = _launch()
+                    if hedge is not None:
+                        logger.info(f"路由端点 {current.name} 超过 {delay:.2f}s 未响应，发起对冲请求")
+                        current = hedge
+                    continue
+
+                for task in done:
+                    tasks.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+
+                if candidates and not tasks:
+                    current = _launch() or current
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task, result in zip(tasks, await asyncio.gather(*tasks, return_exceptions=True)):
+                if stream and isinstance(result, tuple):
+                    await result[1].aclose()
+
+        raise RuntimeError(f"所有路由端点均请求失败: {last_error}")
+
+    async def _route_sync(self, request: ModelRequest) -> ModelCompletions:
+        try:
+            return await self._race(request, stream=False)
+        except RuntimeError as e:
+            logger.error(str(e))
+            return ModelCompletions(text=str(e), succeed=False)
+
+    async def _route_stream(self, request: ModelRequest) -> AsyncGenerator[ModelStreamCompletions, None]:
+        try:
+            first, generator = await self._race(request, stream=True)
+        except RuntimeError as e:
+            logger.error(str(e))
+            yield ModelStreamCompletions(chunk=str(e), succeed=False)
+            return
+
+        try:
+            yield first
+            async for chunk in generator:
+                yield chunk
+        finally:
+            await generator.aclose()
+
+    @overload
+    async def ask(self, request: ModelRequest, *, stream: Literal[False] = False) -> ModelCompletions: ...
+
+    @overload
+    async def ask(
+        self, request: ModelRequest, *, stream: Literal[True] = True
+    ) -> AsyncGenerator[ModelStreamCompletions, None]: ...
+
+    async def ask(
+        self, request: ModelRequest, *, stream: bool = False
+    ) -> Union[ModelCompletions, AsyncGenerator[ModelStreamCompletions, None]]:
+        """
+        模型交互询问
+
+        :param request: 模型调用请求体
+        :param stream: 是否开启流式对话
+
+        :return: 模型输出体
+        """
+        if stream:
+            return self._route_stream(request)
+
+        return await self._route_sync(request)
@@ -1,16 +1,328 @@
+import asyncio
 import base64
-from typing import Optional
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from importlib.util import find_spec
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from nonebot import logger
+from nonebot_plugin_localstore import get_plugin_cache_dir
+
+from ...models import Resource
+from ...utils.cache import LRUCache
+
+if TYPE_CHECKING:
+    from .._config import ModelConfig
+
+_CacheKey = tuple[str, int, int]
+"""(文件路径, 修改时间, 文件大小)"""
+
+_base64_cache: Optional[LRUCache[_CacheKey, str]] = None
+_disk_cache_dir: Optional[Path] = None
+_disk_cache_limit = 0
+"""磁盘缓存的容量上限（字节）"""
+_disk_cache_bytes = 0
+"""磁盘缓存的当前占用（字节，清理时按实际文件重新统计）"""
+_disk_cache_lock = threading.Lock()
+
+_DISK_CACHE_PRUNE_RATIO = 0.9
+"""磁盘缓存超出上限时，删除最久未使用的文件直至占用低于上限的该比例"""
+
+
+def _get_cache() -> Optional[LRUCache[_CacheKey, str]]:
+    """
+    获取 Base64 编码缓存（首次调用时按插件配置初始化）
+    """
+    global _base64_cache, _disk_cache_dir, _disk_cache_limit, _disk_cache_bytes
+
+    if _base64_cache is None:
+        from ...config import plugin_config
+
+        if plugin_config.base64_cache_size <= 0:
+            return None
+
+        _base64_cache = LRUCache(maxsize=0, maxbytes=plugin_config.base64_cache_size * 1024 * 1024, sizeof=len)
+        if plugin_config.enable_base64_disk_cache and plugin_config.base64_disk_cache_size > 0:
+            _disk_cache_dir = get_plugin_cache_dir() / "base64"
+            _disk_cache_dir.mkdir(parents=True, exist_ok=True)
+            _disk_cache_limit = plugin_config.base64_disk_cache_size * 1024 * 1024
+            for tmp_path in _disk_cache_dir.glob("*.tmp"):
+                tmp_path.unlink(missing_ok=True)  # 中断写入遗留的临时文件
+            _disk_cache_bytes = sum(path.stat().st_size for path in _disk_cache_dir.glob("*.b64"))
+
+    return _base64_cache
+
+
+def _cache_key(local_path: str) -> _CacheKey:
+    stat = os.stat(local_path)
+    return (os.path.abspath(local_path), stat.st_mtime_ns, stat.st_size)
+
+
+def _disk_cache_path(key: _CacheKey) -> Optional[Path]:
+    if _disk_cache_dir is None:
+        return None
+    digest = hashlib.md5(repr(key).encode("utf-8"), usedforsecurity=False).hexdigest()
+    return _disk_cache_dir / f"{digest}.b64"
+
+
+def _prune_disk_cache():
+    """
+    按修改时间删除最久未使用的磁盘缓存文件，直至占用低于上限（调用方需持有 `_disk_cache_lock`）
+    """
+    global _disk_cache_bytes
+
+    if _disk_cache_dir is None:
+        return
+
+    entries = []
+    for path in _disk_cache_dir.glob("*.b64"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+        if total <= _disk_cache_limit * _DISK_CACHE_PRUNE_RATIO:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+    _disk_cache_bytes = total
+
+
+def _write_disk_cache(disk_path: Path, data: str):
+    """
+    写入磁盘缓存（每次写入使用独立的临时文件），超出容量上限时清理最久未使用的文件
+    """
+    global _disk_cache_bytes
+
+    if len(data) > _disk_cache_limit * _DISK_CACHE_PRUNE_RATIO:
+        return
+
+    fd, tmp_name = tempfile.mkstemp(prefix=f"{disk_path.name}.", suffix=".tmp", dir=disk_path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write(data)
+        os.replace(tmp_name, disk_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+    with _disk_cache_lock:
+        _disk_cache_bytes += len(data)
+        if _disk_cache_bytes > _disk_cache_limit:
+            _prune_disk_cache()
+
+
+def _encode_file(local_path: str, key: _CacheKey) -> str:
+    """
+    读取文件并编码（优先读取磁盘缓存），可在线程池中执行
+    """
+    disk_path = _disk_cache_path(key)
+    if disk_path is not None:
+        try:
+            data = disk_path.read_text("ascii")
+            os.utime(disk_path)  # 以修改时间记录最近使用时间
+            return data
+        except OSError:
+            pass  # 未命中或已被清理
+
+    with open(local_path, "rb") as f:
+        data = base64.b64encode(f.read()).decode("utf-8")
+
+    if disk_path is not None:
+        try:
+            _write_disk_cache(disk_path, data)
+        except OSError as e:
+            logger.warning(f"写入 Base64 磁盘缓存失败: {e}")
+
+    return data
 
 
 def get_file_base64(local_path: Optional[str] = None, file_bytes: Optional[bytes] = None) -> str:
     """
     获取本地图像 Base64 的方法
+
+    本地文件的编码结果按 (路径, 修改时间, 大小) 缓存，文件被修改后自动失效
     """
     if local_path:
-        with open(local_path, "rb") as f:
-            image_data = base64.b64encode(f.read()).decode("utf-8")
-            return image_data
+        cache = _get_cache()
+        if cache is None:
+            with open(local_path, "rb") as f:
+                return base64.b64encode(f.read()).decode("utf-8")
+
+        key = _cache_key(local_path)
+        image_data = cache.get(key)
+        if image_data is None:
+            image_data = _encode_file(local_path, key)
+            cache.set(key, image_data)
+        return image_data
     if file_bytes:
         image_base64 = base64.b64encode(file_bytes)
         return image_base64.decode("utf-8")
     raise ValueError("You must pass in a valid parameter!")
+
+
+async def prefetch_file_base64(paths: Iterable[str]):
+    """
+    在线程池中预先编码尚未缓存的文件，使随后构建请求体时的 `get_file_base64` 直接命中缓存，避免阻塞事件循环
+
+    :param paths: 本地文件路径
+    """
+    cache = _get_cache()
+    if cache is None:
+        return
+
+    pending: dict[_CacheKey, str] = {}
+    for path in paths:
+        try:
+            key = _cache_key(path)
+        except OSError:
+            continue  # 文件不存在时交由模型加载器自行处理
+        if key not in pending and key not in cache:
+            pending[key] = path
+
+    if not pending:
+        return
+
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_encode_file, path, key) for key, path in pending.items()), return_exceptions=True
+    )
+    for key, result in zip(pending, results):
+        if isinstance(result, str):
+            cache.set(key, result)
+
+
+_IMAGE_SUFFIXES = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+
+_variant_cache: LRUCache[tuple[_CacheKey, int, str, int], str] = LRUCache(maxsize=4096)
+"""(原图缓存键, 最长边, 格式, 质量) -> 实际发送的图片路径"""
+
+_image_executor: Optional[Executor] = None
+
+
+def _get_image_executor() -> Executor:
+    """
+    获取图片处理线程池（首次调用时创建）
+
+    Pillow 在解码、缩放与编码时会释放 GIL，因此线程池即可并行处理多张图片且不阻塞事件循环。
+    这里不使用进程池：在已有事件循环与后台线程的进程中 fork 可能死锁，
+    而 spawn/forkserver 子进程需要重新执行入口脚本并导入本插件，不适用于 NoneBot 的启动方式
+    """
+    global _image_executor
+
+    if _image_executor is None:
+        from ...config import plugin_config
+
+        _image_executor = ThreadPoolExecutor(
+            max_workers=max(plugin_config.image_workers, 1), thread_name_prefix="muicebot-image"
+        )
+    return _image_executor
+
+
+def _variant_path(local_path: str, max_edge: int, format: str, quality: int) -> Path:
+    path = Path(local_path)
+    return path.with_name(f"{path.stem}.{max_edge}q{quality}.{_IMAGE_SUFFIXES[format]}")
+
+
+def _downscale_image(local_path: str, max_edge: int, format: str, quality: int) -> str:
+    """
+    缩放并重新编码图片（不保留 EXIF 等元数据），在图片处理线程池中执行
+
+    :return: 处理后的图片路径；无需处理或处理后反而更大时返回原路径
+    """
+    from PIL import Image, ImageOps
+
+    target = _variant_path(local_path, max_edge, format, quality)
+    if target.exists() and target.stat().st_mtime >= os.path.getmtime(local_path):
+        return str(target)
+
+    with Image.open(local_path) as image:
+        if getattr(image, "is_animated", False):
+            return local_path
+
+        resized = max(image.size) > max_edge
+        output = ImageOps.exif_transpose(image)
+        output.thumbnail((max_edge, max_edge))
+        if format == "jpeg" and output.mode not in ("RGB", "L"):
+            output = output.convert("RGB")
+
+        # 同一图片可能被多个线程同时处理，每次写入使用独立的临时文件
+        fd, tmp_name = tempfile.mkstemp(prefix=f"{target.name}.", suffix=".tmp", dir=target.parent)
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        try:
+            output.save(tmp_path, format=format.upper(), quality=quality, optimize=True)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    if not resized and tmp_path.stat().st_size >= os.path.getsize(local_path):
+        tmp_path.unlink(missing_ok=True)
+        return local_path
+
+    os.replace(tmp_path, target)
+    return str(target)
+
+
+async def _preprocess_image(local_path: str, max_edge: int, format: str, quality: int) -> str:
+    try:
+        key = (_cache_key(local_path), max_edge, format, quality)
+    except OSError:
+        return local_path
+
+    if (variant := _variant_cache.get(key)) is not None:
+        return variant
+
+    try:
+        loop = asyncio.get_running_loop()
+        variant = await loop.run_in_executor(
+            _get_image_executor(), _downscale_image, local_path, max_edge, format, quality
+        )
+    except Exception as e:
+        logger.warning(f"图片预处理失败，将发送原图: {e}")
+        return local_path
+
+    _variant_cache.set(key, variant)
+    return variant
+
+
+async def preprocess_images(resources: list[Resource], config: "ModelConfig") -> list[Resource]:
+    """
+    按模型配置缩放并重新编码图片资源，处理结果缓存在原图旁
+
+    :param resources: 多模态资源列表（不会被修改）
+    :param config: 模型配置
+
+    :return: 替换为处理后图片的资源列表
+    """
+    if config.image_max_edge <= 0 or not any(r.type == "image" and r.path for r in resources):
+        return resources
+
+    if find_spec("PIL") is None:
+        logger.warning("未安装 pillow，跳过图片预处理")
+        return resources
+
+    async def _process(resource: Resource) -> Resource:
+        if resource.type != "image" or not resource.path:
+            return resource
+        path = await _preprocess_image(resource.path, config.image_max_edge, config.image_format, config.image_quality)
+        return resource if path == resource.path else Resource("image", path=path, url=resource.url)
+
+    return list(await asyncio.gather(*(_process(resource) for resource in resources)))
+
+
+def shutdown_image_executor():
+    """
+    关闭图片处理线程池
+    """
+    global _image_executor
+
+    if _image_executor is not None:
+        _image_executor.shutdown(wait=False, cancel_futures=True)
+        _image_executor = None
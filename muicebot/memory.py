@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+from nonebot import logger
+from nonebot_plugin_localstore import get_plugin_data_dir
+from nonebot_plugin_orm import async_scoped_session, get_session
+
+from .database import MessageORM
+from .llm import EmbeddingModel, VectorIndex, load_embedding_model
+from .models import Message
+from .utils.cache import LRUCache
+
+MEMORY_CONTEXT_PREFIX = "以下是你与用户此前与当前话题相关的对话，请在回复时参考：\n"
+"""注入系统提示时的长期记忆前缀"""
+
+_INDEX_DELAY = 5.0
+"""保存对话后延迟建立索引的时间（秒）：等待对话落库，并将短时间内的多轮对话合并为一次嵌入请求"""
+
+_INDEX_BATCH = 256
+"""单次建立索引时读取的最大对话数"""
+
+_MAX_DOCUMENT_CHARS = 2000
+"""计算嵌入的对话文本的最大长度（字符），超出部分被截断，以免超过嵌入模型的输入上限"""
+
+
+class LongTermMemory:
+    """
+    长期记忆（仅私聊）
+
+    对保存的私聊对话计算嵌入，按 (userid, profile) 分别存储于本地向量索引中；
+    调用模型时检索与当前消息语义相关、且不在当前上下文中的历史对话，作为系统提示注入。
+
+    索引以消息 ID 标识对话并从上次索引的位置增量追加，检索结果会回查数据库，
+    因此被撤销或重置的对话不会被注入
+    """
+
+    def __init__(self, enabled: bool, embedding: Optional[str], top_k: int, min_score: float) -> None:
+        self.enabled = enabled
+        """是否启用长期记忆"""
+        self.embedding = embedding
+        """嵌入模型配置名"""
+        self.top_k = max(top_k, 1)
+        """每次检索注入的最大历史对话数"""
+        self.min_score = min_score
+        """注入的历史对话与当前消息的最低相似度"""
+
+        self._model: Optional[EmbeddingModel] = None
+        self._model_unavailable = False
+        self._directory: Optional[Path] = None
+
+        self._indexes: LRUCache[tuple[str, str], tuple[VectorIndex, int]] = LRUCache(maxsize=128)
+        """(userid, profile) -> (向量索引, 已索引的最后一条消息 ID)"""
+        self._tasks: dict[tuple[str, str], asyncio.Task] = {}
+        self._pending: set[tuple[str, str]] = set()
+
+    def _get_model(self) -> Optional[EmbeddingModel]:
+        """
+        获取嵌入模型（首次调用时加载），加载失败时禁用长期记忆
+        """
+        if self._model is None and not self._model_unavailable:
+            from .config import get_embedding_model_config
+
+            try:
+                config = get_embedding_model_config(self.embedding)
+                self._model = load_embedding_model(config)
+            except Exception as e:
+                logger.warning(f"长期记忆不可用: {e}")
+                self._model_unavailable = True
+                return None
+
+            # 不同嵌入模型的向量不可混用，索引按模型分目录存放
+            identity = f"{config.provider}:{config.api_host}:{config.model}"
+            namespace = hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+            self._directory = get_plugin_data_dir() / "memory" / namespace
+            self._directory.mkdir(parents=True, exist_ok=True)
+
+        return self._model
+
+    def _index_path(self, key: tuple[str, str]) -> Path:
+        assert self._directory is not None
+        digest = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+        return self._directory / f"{digest}.npz"
+
+    async def _get_index(self, key: tuple[str, str]) -> tuple[VectorIndex, int]:
+        cached = self._indexes.get(key)
+        if cached is not None:
+            return cached
+
+        path = self._index_path(key)
+        if path.exists():
+            try:
+                index = await asyncio.to_thread(VectorIndex.load, path)
+                result = (index, max((int(id) for id in index.ids), default=0))
+            except Exception as e:
+                logger.warning(f"加载长期记忆索引失败，将重新建立: {e}")
+                result = (VectorIndex(quantize=True), 0)
+        else:
+            result = (VectorIndex(quantize=True), 0)
+
+        self._indexes.set(key, result)
+        return result
+
+    @staticmethod
+    def dialogue_key(message: Message) -> tuple[str, str, str, str]:
+        """
+        对话的标识（写入队列中的对话尚无 ID）
+        """
+        return message.time, message.userid, message.message, message.respond
+
+    @staticmethod
+    def _document(message: Message) -> str:
+        """
+        对话文本
+        """
+        return f"用户: {message.message}\n助手: {message.respond}"
+
+    @staticmethod
+    def _embedding_text(message: Message) -> str:
+        """
+        用于计算嵌入的对话文本（截断至 `_MAX_DOCUMENT_CHARS`）
+        """
+        return LongTermMemory._document(message)[:_MAX_DOCUMENT_CHARS]
+
+    @staticmethod
+    async def _embed_messages(
+        model: EmbeddingModel, messages: list[Message]
+    ) -> Optional[tuple[list[Message], list[list[float]]]]:
+        """
+        计算对话的嵌入；整批失败时逐条重试，跳过仍然失败的对话
+
+        :return: 成功计算嵌入的对话及其嵌入；全部失败（通常是嵌入服务不可用）时返回 None
+        """
+        result = await model.embed([LongTermMemory._embedding_text(message) for message in messages])
+        if result.succeed:
+            return messages, result.embeddings
+
+        embedded: list[Message] = []
+        embeddings: list[list[float]] = []
+        for message in messages:
+            single = await model.embed([LongTermMemory._embedding_text(message)])
+            if single.succeed and single.embeddings:
+                embedded.append(message)
+                embeddings.append(single.embeddings[0])
+
+        if not embedded:
+            return None
+        if len(embedded) < len(messages):
+            logger.warning(f"跳过 {len(messages) - len(embedded)} 轮无法计算嵌入的对话")
+        return embedded, embeddings
+
+    @staticmethod
+    async def _save_index(index: VectorIndex, path: Path):
+        """
+        在线程中保存索引；任务被取消时仍等待写入完成，使 `reset` 删除的索引文件不会被随后的写入恢复
+        """
+        save = asyncio.ensure_future(asyncio.to_thread(index.save, path))
+        try:
+            await asyncio.shield(save)
+        except asyncio.CancelledError:
+            await asyncio.gather(save, return_exceptions=True)
+            raise
+
+    def schedule(self, userid: str, profile: str):
+        """
+        调度后台任务，为用户指定存档中尚未索引的私聊对话建立索引
+        """
+        if not self.enabled or self._model_unavailable:
+            return
+
+        key = (userid, profile)
+        if key in self._tasks:
+            self._pending.add(key)
+            return
+
+        task = asyncio.create_task(self._run(key))
+        self._tasks[key] = task
+        task.add_done_callback(lambda task: self._discard_task(key, task))
+
+    def _discard_task(self, key: tuple[str, str], task: asyncio.Task):
+        """
+        任务结束后移除其记录（若记录已被新任务替换则保留）
+        """
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def _run(self, key: tuple[str, str]):
+        """
+        后台索引任务：在运行期间有新的对话保存时继续追加索引
+        """
+        while True:
+            self._pending.discard(key)
+            await asyncio.sleep(_INDEX_DELAY)
+            try:
+                await self._index(key)
+            except Exception as e:
+                logger.error(f"建立长期记忆索引失败: {e}")
+                return
+            if key not in self._pending:
+                return
+
+    async def _index(self, key: tuple[str, str]):
+        model = self._get_model()
+        if model is None:
+            return
+
+        userid, profile = key
+        index, last_msg_id = await self._get_index(key)
+
+        while True:
+            async with get_session() as session:
+                messages = await MessageORM.get_private_history_after(
+                    session, userid, profile, last_msg_id, _INDEX_BATCH
+                )
+                await session.commit()
+
+            messages = [message for message in messages if message.id is not None]
+            if not messages:
+                return
+
+            embedded = await self._embed_messages(model, messages)
+            if embedded is None:
+                logger.warning(f"长期记忆嵌入失败，将在下次保存对话时重试 (用户 {userid})")
+                return
+
+            embedded_messages, embeddings = embedded
+            index.add([str(message.id) for message in embedded_messages], embeddings)
+            last_msg_id = max(message.id for message in messages if message.id is not None)
+            self._indexes.set(key, (index, last_msg_id))
+            await self._save_index(index, self._index_path(key))
+            logger.debug(f"已为用户 {userid} 的 {len(embedded_messages)} 轮对话建立长期记忆索引")
+
+            if len(messages) < _INDEX_BATCH:
+                return
+
+    async def recall(
+        self,
+        session: async_scoped_session,
+        userid: str,
+        profile: str,
+        query: str,
+        exclude: set[tuple[str, str, str, str]],
+    ) -> list[Message]:
+        """
+        检索与当前消息语义相关的历史对话
+
+        :param query: 当前消息
+        :param exclude: 已在上下文中的对话，以 (time, userid, message, respond) 标识（写入队列中的对话尚无 ID）
+        :return: 按时间排序的历史对话
+        """
+        if not (self.enabled and query.strip()):
+            return []
+
+        model = self._get_model()
+        if model is None:
+            return []
+
+        index, _ = await self._get_index((userid, profile))
+        if not len(index):
+            return []
+
+        result = await model.embed([query])
+        if not (result.succeed and result.embeddings):
+            return []
+
+        # 多取一些候选，以弥补位于当前上下文中或已被撤销的对话
+        hits = index.search(result.embeddings[0], self.top_k + len(exclude), self.min_score)
+        ranked = [int(id) for id, _ in hits]
+        messages = await MessageORM.get_available_messages(session, userid, profile, ranked)
+        available = {item.id for item in messages if self.dialogue_key(item) not in exclude}
+        ids = set([id for id in ranked if id in available][: self.top_k])
+        return [item for item in messages if item.id in ids]
+
+    async def reset(self, userid: str, profile: str):
+        """
+        删除用户指定存档的长期记忆索引，并取消正在进行的索引任务
+        """
+        key = (userid, profile)
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+            # 等待任务结束（包括进行中的索引写入），再删除索引文件
+            await asyncio.gather(task, return_exceptions=True)
+        self._pending.discard(key)
+        self._indexes.pop(key)
+
+        if self.enabled and self._get_model() is not None:
+            self._index_path(key).unlink(missing_ok=True)
+
+    @staticmethod
+    def format(messages: list[Message]) -> Optional[str]:
+        """
+        将检索到的历史对话格式化为系统提示片段
+        """
+        if not messages:
+            return None
+        dialogue = "\n\n".join(f"[{message.time}] {LongTermMemory._document(message)}" for message in messages)
+        return f"{MEMORY_CONTEXT_PREFIX}{dialogue}"
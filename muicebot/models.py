@@ -86,6 +86,8 @@ class Message:
     """使用的总 tokens, 若模型加载器不支持则设为-1"""
     profile: str = "_default"
     """消息所属存档"""
+    tokens: Optional[int] = None
+    """估算的 Token 数（用户消息、多模态资源与模型回复），用于按 Token 预算截取对话历史"""
 
     @property
     def format_time(self) -> datetime:
@@ -1,31 +1,45 @@
+import asyncio
+import heapq
+import math
 import os
 import time
-from typing import AsyncGenerator, Optional, Union
+from dataclasses import replace
+from typing import AsyncContextManager, AsyncGenerator, Optional, Union
 
 from nonebot import logger
 from nonebot_plugin_orm import async_scoped_session
 
+from .admission import AdmissionController, AdmissionRejected
 from .config import (
     ModelConfig,
     get_model_config,
     get_model_config_manager,
     plugin_config,
 )
-from .database import MessageORM
+from .database import MessageORM, UserORM, run_after_transaction
 from .llm import (
     MODEL_DEPENDENCY_MAP,
+    BaseLLM,
     ModelCompletions,
     ModelRequest,
     ModelStreamCompletions,
     get_missing_dependencies,
     load_model,
 )
+from .memory import LongTermMemory
 from .models import Message, Resource
 from .plugin.func_call import get_function_list
 from .plugin.hook import HookType, hook_manager
 from .plugin.mcp import get_mcp_list
+from .summarizer import HistorySummarizer
 from .templates import generate_prompt_from_template
-from .utils.utils import get_username
+from .utils.context_cache import ContextCache
+from .utils.tokens import (
+    estimate_message_tokens,
+    estimate_resources_tokens,
+    estimate_text_tokens,
+)
+from .utils.utils import get_username, get_usernames
 
 
 class Muice:
@@ -52,10 +66,28 @@ class Muice:
 
         self.database = MessageORM()
         self.max_history_epoch = plugin_config.max_history_epoch
+        self.context_cache = ContextCache()
+        self.summarizer = HistorySummarizer(
+            plugin_config.enable_history_summary,
+            plugin_config.history_summary_threshold,
+            plugin_config.history_summary_keep,
+        )
+        self.memory = LongTermMemory(
+            plugin_config.enable_long_term_memory,
+            plugin_config.long_term_memory_embedding,
+            plugin_config.long_term_memory_top_k,
+            plugin_config.long_term_memory_min_score,
+        )
+        self.admission = AdmissionController(plugin_config.admission_max_queue, plugin_config.admission_queue_timeout)
 
         self.system_prompt = ""
         self.user_instructions = ""
 
+        try:
+            self._loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+
         self._load_config()
         self._init_model()
 
@@ -88,6 +120,8 @@ class Muice:
         """
         初始化模型类
         """
+        old_model: Optional[BaseLLM] = getattr(self, "model", None)
+
         try:
             self.model = load_model(self.model_config)
 
@@ -102,6 +136,27 @@ class Muice:
                 logger.critical(f"缺少依赖库：{', '.join(missing)}\n请运行以下命令安装缺失项：\n\n{install_command}")
             sys.exit(1)
 
+        if old_model is not None and old_model is not self.model:
+            self._close_model(old_model)
+
+    def _close_model(self, model: BaseLLM):
+        """
+        在事件循环中关闭被替换的模型实例（配置文件监听器的回调运行在监视线程中）
+
+        进行中的调用与流式输出仍持有旧实例，待其全部结束后再关闭
+        """
+        try:
+            asyncio.get_running_loop().create_task(model.close_when_idle())
+        except RuntimeError:
+            if self._loop is not None and not self._loop.is_closed():
+                asyncio.run_coroutine_threadsafe(model.close_when_idle(), self._loop)
+
+    async def close(self):
+        """
+        关闭当前模型实例
+        """
+        await self.model.close()
+
     def load_model(self) -> bool:
         """
         加载模型
@@ -186,35 +241,209 @@ class Muice:
         :param enable_history: 是否启用历史记录
         :return: 最终模型提示词
         """
-        user_history = (
-            await self.database.get_user_history(session, userid, self.max_history_epoch) if enable_history else []
-        )
+        user_history: list[Message] = []
+
+        if enable_history:
+            user_key = self.context_cache.user_key(userid, await UserORM.get_user_profile(session, userid))
+            cached_history = self.context_cache.get(user_key)
+
+            if cached_history is not None:
+                user_history = cached_history
+            else:
+                user_history = await self.database.get_user_history(session, userid, self.max_history_epoch)
 
-        # 验证多模态资源路径是否可用
-        for item in user_history:
-            item.resources = [
-                resource for resource in item.resources if resource.path and os.path.isfile(resource.path)
-            ]
+                # 验证多模态资源路径是否可用
+                for item in user_history:
+                    item.resources = self._available_resources(item.resources)
+                    item.tokens = estimate_message_tokens(item) if item.tokens is None else item.tokens
+
+                self.context_cache.set(user_key, user_history)
 
         if groupid == "-1":
             return user_history[-self.max_history_epoch :]
 
-        group_history = await self.database.get_group_history(session, groupid, self.max_history_epoch)
+        group_key = self.context_cache.group_key(groupid)
+        cached_history = self.context_cache.get(group_key)
 
-        for item in group_history:
-            item.resources = [
-                resource for resource in item.resources if resource.path and os.path.isfile(resource.path)
-            ]
+        if cached_history is not None:
+            group_history = cached_history
+        else:
+            group_history = await self.database.get_group_history(session, groupid, self.max_history_epoch)
 
-        # 群聊历史构建成 <Username> Message 的格式，避免上下文混乱
-        for item in group_history:
-            user_name = await get_username(item.userid)
-            item.message = f"<{user_name}> {item.message}"
+            for item in group_history:
+                item.resources = self._available_resources(item.resources)
+                item.tokens = estimate_message_tokens(item) if item.tokens is None else item.tokens
 
-        final_history = list(set(user_history + group_history))
+            # 群聊历史构建成 <Username> Message 的格式，避免上下文混乱
+            usernames = await self._resolve_usernames(session, {item.userid for item in group_history})
+            for item in group_history:
+                item.message = f"<{usernames[item.userid]}> {item.message}"
+
+            self.context_cache.set(group_key, group_history)
+
+        final_history = self._merge_history(group_history, user_history)
 
         return final_history[-self.max_history_epoch :]
 
+    @staticmethod
+    def _merge_history(*histories: list[Message]) -> list[Message]:
+        """
+        按消息 ID 归并多个已排序的对话历史并去重
+
+        尚未落库（ID 为空）的消息视为最新消息。由于同一条消息可能在一份历史中带有 ID（从数据库加载）、
+        在另一份中没有（延迟写入时追加到缓存），统一以 (时间, 用户, 回复) 判断重复。
+        重复消息保留排序在前的版本
+        """
+
+        def dedup_key(message: Message):
+            return (message.time, message.userid, message.respond)
+
+        seen = set()
+        merged: list[Message] = []
+
+        for message in heapq.merge(*histories, key=lambda m: m.id if m.id is not None else math.inf):
+            key = dedup_key(message)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(message)
+
+        return merged
+
+    async def _apply_summary(
+        self, session: async_scoped_session, message: Message, history: list[Message], enable_history: bool = True
+    ) -> tuple[list[Message], Optional[str]]:
+        """
+        以对话摘要代替较早的私聊历史（仅在启用摘要时生效）
+
+        :return: 剩余的对话历史, 用于注入系统提示的摘要
+        """
+        if not (self.summarizer.enabled and enable_history and message.groupid == "-1"):
+            return history, None
+
+        profile = await UserORM.get_user_profile(session, message.userid)
+        history, content = await self.summarizer.apply(session, self.model, message.userid, profile, history)
+        return history, self.summarizer.format(content)
+
+    async def _recall_memory(
+        self, session: async_scoped_session, message: Message, history: list[Message], enable_history: bool = True
+    ) -> Optional[str]:
+        """
+        检索与当前消息相关、且不在上下文中的历史私聊对话（仅在启用长期记忆时生效）
+
+        :return: 用于注入系统提示的长期记忆
+        """
+        if not (self.memory.enabled and enable_history and message.groupid == "-1"):
+            return None
+
+        profile = await UserORM.get_user_profile(session, message.userid)
+        exclude = {self.memory.dialogue_key(item) for item in history}
+        try:
+            memories = await self.memory.recall(session, message.userid, profile, message.message, exclude)
+        except Exception as e:
+            logger.warning(f"检索长期记忆失败: {e}")
+            return None
+        return self.memory.format(memories)
+
+    def _fit_history(
+        self, history: list[Message], prompt: str, system: Optional[str], resources: list[Resource]
+    ) -> list[Message]:
+        """
+        按 Token 预算从最新的对话开始保留历史（仅在配置了 `max_context_tokens` 时生效）
+
+        预算 = 上下文窗口大小 - 最大回复 Tokens - 当前提示词（含系统提示与多模态资源）
+        """
+        if not self.model_config.max_context_tokens:
+            return history
+
+        budget = (
+            self.model_config.max_context_tokens
+            - self.model_config.max_tokens
+            - estimate_text_tokens(prompt)
+            - estimate_text_tokens(system)
+            - estimate_resources_tokens(resources)
+        )
+
+        kept = 0
+        for item in reversed(history):
+            tokens = estimate_message_tokens(item) if item.tokens is None else item.tokens
+            if tokens > budget:
+                break
+            budget -= tokens
+            kept += 1
+
+        if kept < len(history):
+            logger.debug(f"对话历史超出 Token 预算，已截取最近的 {kept}/{len(history)} 条")
+
+        return history[len(history) - kept :]
+
+    @staticmethod
+    async def _resolve_usernames(session: async_scoped_session, userids: set[str]) -> dict[str, str]:
+        """
+        并发获取用户名，并将新获取到的用户名记录为用户昵称（用于下次启动时预热缓存）
+        """
+        usernames = await get_usernames(userids)
+        nicknames = await UserORM.get_nicknames(session, userids)
+
+        for userid, username in usernames.items():
+            if username != userid and nicknames.get(userid) != username:
+                await UserORM.set_nickname(session, userid, username)
+
+        return usernames
+
+    @staticmethod
+    def _available_resources(resources: list[Resource]) -> list[Resource]:
+        """
+        过滤出本地文件仍然存在的多模态资源
+        """
+        return [resource for resource in resources if resource.path and os.path.isfile(resource.path)]
+
+    async def _save_message(self, session: async_scoped_session, message: Message):
+        """
+        保存对话，并将其追加到已缓存的会话上下文中
+        """
+        await self.database.add_item(session, message)
+
+        profile = await UserORM.get_user_profile(session, message.userid)
+        if message.groupid == "-1":
+            self.memory.schedule(message.userid, profile)
+
+        item = replace(message, profile=profile, resources=self._available_resources(message.resources))
+        self.context_cache.append(self.context_cache.user_key(message.userid, profile), item, self.max_history_epoch)
+
+        group_key = self.context_cache.group_key(message.groupid)
+        if message.groupid != "-1" and group_key in self.context_cache:
+            item.message = f"<{await get_username(message.userid)}> {message.message}"
+            self.context_cache.append(group_key, item, self.max_history_epoch)
+
+    def _admission_slot(self, message: Message) -> AsyncContextManager[None]:
+        """
+        获取本次模型调用的准入许可（公平调度以私聊用户或群组为单位）
+        """
+        if message.groupid == "-1":
+            return self.admission.slot(
+                self.model_config, f"user:{message.userid}", plugin_config.admission_private_weight
+            )
+        return self.admission.slot(self.model_config, f"group:{message.groupid}")
+
+    async def _ask_stream_admitted(
+        self, message: Message, model_request: ModelRequest
+    ) -> AsyncGenerator[ModelStreamCompletions, None]:
+        """
+        在准入许可内进行流式调用，许可在输出结束后释放；被拒绝时输出繁忙提示
+        """
+        try:
+            async with self._admission_slot(message), self.model.in_use() as model:
+                response = await model.ask(model_request, stream=True)
+                try:
+                    async for item in response:
+                        yield item
+                finally:
+                    await response.aclose()
+        except AdmissionRejected as e:
+            logger.warning(f"模型调用被拒绝: {e}")
+            yield ModelStreamCompletions(plugin_config.busy_reply, succeed=False)
+
     async def ask(
         self,
         session: async_scoped_session,
@@ -245,13 +474,16 @@ class Muice:
             if enable_history
             else []
         )
+        history, summary = await self._apply_summary(session, message, history, enable_history)
+        memory = await self._recall_memory(session, message, history, enable_history)
         tools = (
             (await get_function_list() + await get_mcp_list())
             if self.model_config.function_call and enable_plugins
             else []
         )
-        system = self.system_prompt if self.system_prompt else None
+        system = "\n\n".join(filter(None, [self.system_prompt, summary, memory])) or None
         resources = message.resources if self.model_config.multimodal else []
+        history = self._fit_history(history, prompt, system, resources)
 
         model_request = ModelRequest(prompt, history, resources, tools, system)
         await hook_manager.run(HookType.BEFORE_MODEL_COMPLETION, model_request)
@@ -259,7 +491,12 @@ class Muice:
         start_time = time.perf_counter()
         logger.debug(f"模型调用参数：Prompt: {message}, History: {history}")
 
-        response = await self.model.ask(model_request, stream=False)
+        try:
+            async with self._admission_slot(message), self.model.in_use() as model:
+                response = await model.ask(model_request, stream=False)
+        except AdmissionRejected as e:
+            logger.warning(f"模型调用被拒绝: {e}")
+            return ModelCompletions(plugin_config.busy_reply, succeed=False)
 
         end_time = time.perf_counter()
 
@@ -279,7 +516,7 @@ class Muice:
         await hook_manager.run(HookType.ON_FINISHING_CHAT, message)
 
         if response.succeed:
-            await self.database.add_item(session, message)
+            await self._save_message(session, message)
 
         return response
 
@@ -314,13 +551,16 @@ class Muice:
             if enable_history
             else []
         )
+        history, summary = await self._apply_summary(session, message, history, enable_history)
+        memory = await self._recall_memory(session, message, history, enable_history)
         tools = (
             (await get_function_list() + await get_mcp_list())
             if self.model_config.function_call and enable_plugins
             else []
         )
-        system = self.system_prompt if self.system_prompt else None
+        system = "\n\n".join(filter(None, [self.system_prompt, summary, memory])) or None
         resources = message.resources if self.model_config.multimodal else []
+        history = self._fit_history(history, prompt, system, resources)
 
         model_request = ModelRequest(prompt, history, resources, tools, system)
         await hook_manager.run(HookType.BEFORE_MODEL_COMPLETION, model_request)
@@ -328,7 +568,7 @@ class Muice:
         start_time = time.perf_counter()
         logger.debug(f"模型调用参数：Prompt: {message}, History: {history}")
 
-        response = await self.model.ask(model_request, stream=True)
+        response = self._ask_stream_admitted(message, model_request)
 
         total_reply = ""
         total_resources: list[Resource] = []
@@ -376,7 +616,16 @@ class Muice:
         await hook_manager.run(HookType.ON_FINISHING_CHAT, message)
 
         if item.succeed:
-            await self.database.add_item(session, message)
+            await self._save_message(session, message)
+
+    def _invalidate_context(self, session: async_scoped_session, userid: str):
+        """
+        使用户的上下文缓存失效，并在事务结束后再次失效
+
+        事务提交前并发的请求仍会读到旧的历史记录并重新缓存，因此需要在提交（或回滚）后再次失效
+        """
+        self.context_cache.invalidate_user(userid)
+        run_after_transaction(session, lambda: self.context_cache.invalidate_user(userid))
 
     async def refresh(
         self, userid: str, session: async_scoped_session
@@ -397,6 +646,7 @@ class Muice:
         last_item = user_history[0]
 
         await self.database.mark_history_as_unavailable(session, userid, 1)
+        self._invalidate_context(session, userid)
 
         if not self.model_config.stream:
             return await self.ask(session, last_item)
@@ -408,8 +658,13 @@ class Muice:
         清空历史对话（将用户对话历史记录标记为不可用）
         """
         await self.database.mark_history_as_unavailable(session, userid)
+        self._invalidate_context(session, userid)
+        profile = await UserORM.get_user_profile(session, userid)
+        await self.summarizer.reset(session, userid, profile)
+        await self.memory.reset(userid, profile)
         return "已成功移除对话历史~"
 
     async def undo(self, userid: str, session: async_scoped_session) -> str:
         await self.database.mark_history_as_unavailable(session, userid, 1)
+        self._invalidate_context(session, userid)
         return "已成功撤销上一段对话~"
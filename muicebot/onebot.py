@@ -1,9 +1,10 @@
+import asyncio
 import os
 import re
 import time
 from datetime import timedelta
 from pathlib import Path
-from typing import AsyncGenerator, Literal
+from typing import AsyncGenerator, Literal, Optional
 from urllib.parse import urlparse
 
 import nonebot_plugin_localstore as store
@@ -33,18 +34,27 @@ from nonebot_plugin_alconna import (
 )
 from nonebot_plugin_alconna.builtins.extensions import ReplyRecordExtension
 from nonebot_plugin_alconna.uniseg import UniMsg
-from nonebot_plugin_orm import async_scoped_session
+from nonebot_plugin_orm import async_scoped_session, get_session
 from nonebot_plugin_session import SessionIdType, extract_session
 
 from .config import load_embedding_model_config, plugin_config
-from .llm import ModelCompletions, ModelStreamCompletions
+from .database import MessageORM, UserORM, message_writer, usage_aggregator
+from .llm import ModelCompletions, ModelStreamCompletions, close_embedding_models
+from .llm.utils.images import shutdown_image_executor
 from .models import Message, Resource
 from .muice import Muice
 from .plugin import get_plugins, load_plugins, set_ctx
 from .plugin.mcp import initialize_servers
 from .scheduler import setup_scheduler
+from .utils.http import close_http_clients
+from .utils.media import fetch_media, media_collector
 from .utils.SessionManager import SessionManager
-from .utils.utils import download_file, get_file_via_adapter, get_version
+from .utils.utils import (
+    download_file,
+    get_file_via_adapter,
+    get_version,
+    prewarm_usernames,
+)
 
 COMMAND_PREFIXES = [".", "/"]
 PLUGINS_PATH = Path("./plugins")
@@ -87,6 +97,22 @@ async def load_bot():
     logger.info(f"MuiceBot 数据目录: {store.get_plugin_data_dir().resolve()}")
     logger.info("加载 MuiceBot 框架...")
 
+    if message_writer.enabled:
+        logger.info("已启用消息延迟写入，恢复暂存数据...")
+        await message_writer.recover()
+
+    async with get_session() as session:
+        prewarm_usernames(await UserORM.get_nicknames(session, limit=4096))
+
+    if plugin_config.log_level.upper() == "DEBUG":
+        async with get_session() as session:
+            for name, ok in (await MessageORM.explain_history_queries(session)).items():
+                if not ok:
+                    logger.warning(f"对话历史查询 {name} 未使用对应的索引，请确认数据库已迁移至最新版本")
+
+    if plugin_config.enable_media_store:
+        media_collector.start()
+
     logger.info("初始化 Muice 实例...")
     muice = Muice.get_instance()
 
@@ -115,6 +141,18 @@ async def load_bot():
     logger.success("MuiceBot 已准备就绪✨")
 
 
+@driver.on_shutdown
+async def unload_bot():
+    logger.info("正在关闭 MuiceBot...")
+    await message_writer.close()
+    await usage_aggregator.close()
+    await media_collector.close()
+    await Muice.get_instance().close()
+    await close_embedding_models()
+    await close_http_clients()
+    shutdown_image_executor()
+
+
 @driver.on_bot_connect
 async def bot_connected():
     logger.success("Bot 已连接，消息处理进程开始运行✨")
@@ -388,11 +426,10 @@ async def handle_command_whoami(bot: Bot, event: Event):
 async def handle_command_profile(
     event: Event, session: async_scoped_session, profile: Match[str] = AlconnaMatch("profile")
 ):
-    from .database import UserORM
-
     userid = event.get_user_id()
     await UserORM.set_profile(session, userid, profile.result)
     await session.commit()
+    Muice.get_instance().context_cache.invalidate_user(userid)
     await UniMessage("成功切换消息存档~").finish()
 
 
@@ -481,49 +518,53 @@ async def _extract_multi_resource(
     message: UniMessage, type: Literal["audio", "image", "video", "file"], event: Event
 ) -> list[Resource]:
     """
-    提取单个多模态文件
+    提取单个多模态文件（同一消息中的文件并发下载）
     """
-    resources = []
 
-    for resource in message:
+    async def _extract(resource: uniseg.Segment) -> Optional[Resource]:
         assert isinstance(resource, uniseg.segment.Media)  # 正常情况下应该都是 Media 的子类
 
         try:
             if resource.path is not None:
                 path = str(resource.path)
             elif resource.url is not None:
-                path = await download_file(resource.url, file_name=_get_media_filename(resource, type))
+                file_name = _get_media_filename(resource, type)
+                if plugin_config.enable_media_store:
+                    path = await fetch_media(resource.url, file_name, file_id=resource.id)
+                else:
+                    path = await download_file(resource.url, file_name=file_name)
             elif resource.origin is not None:
                 logger.warning("无法通过通用方式获取文件URL，回退至适配器自有方式...")
                 path = await get_file_via_adapter(resource.origin, event)  # type: ignore
             else:
-                continue
+                return None
 
-            if path:
-                resources.append(Resource(type, path=path))
+            return Resource(type, path=path) if path else None
         except Exception as e:
             logger.error(f"处理文件失败: {e}")
+            return None
 
-    return resources
+    results = await asyncio.gather(*(_extract(resource) for resource in message))
+    return [resource for resource in results if resource is not None]
 
 
 async def _extract_multi_resources(message: UniMsg, event: Event) -> list[Resource]:
     """
     提取多个多模态文件
     """
-    resources = []
-
     message_audio = message.get(uniseg.Audio) + message.get(uniseg.Voice)
     message_images = message.get(uniseg.Image)
     message_file = message.get(uniseg.File)
     message_video = message.get(uniseg.Video)
 
-    resources.extend(await _extract_multi_resource(message_audio, "audio", event))
-    resources.extend(await _extract_multi_resource(message_file, "file", event))
-    resources.extend(await _extract_multi_resource(message_images, "image", event))
-    resources.extend(await _extract_multi_resource(message_video, "video", event))
+    results = await asyncio.gather(
+        _extract_multi_resource(message_audio, "audio", event),
+        _extract_multi_resource(message_file, "file", event),
+        _extract_multi_resource(message_images, "image", event),
+        _extract_multi_resource(message_video, "video", event),
+    )
 
-    return resources
+    return [resource for resources in results for resource in resources]
 
 
 async def _send_multi_messages(resource: Resource):
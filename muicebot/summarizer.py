@@ -0,0 +1,132 @@
+import asyncio
+from typing import Optional
+
+from nonebot import logger
+from nonebot_plugin_orm import async_scoped_session, get_session
+
+from .database import SummaryORM
+from .llm import BaseLLM, ModelRequest
+from .models import Message
+from .utils.cache import LRUCache
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你是一个对话摘要助手。请将给出的对话记录（以及已有的摘要）整合为一段简洁的摘要，"
+    "保留用户的身份信息、偏好、重要事实与尚未完成的话题，省略寒暄与重复内容。只输出摘要本身。"
+)
+"""生成摘要时使用的系统提示"""
+
+SUMMARY_CONTEXT_PREFIX = "以下是你与用户此前对话的摘要，请在回复时参考：\n"
+"""注入系统提示时的摘要前缀"""
+
+
+class HistorySummarizer:
+    """
+    对话历史摘要
+
+    当对话历史超过阈值时，在后台调用模型将较早的对话（连同已有摘要）增量压缩为一条摘要，
+    此后构建上下文时以摘要代替这些对话
+    """
+
+    def __init__(self, enabled: bool, threshold: int, keep: int) -> None:
+        self.enabled = enabled
+        """是否启用摘要"""
+        self.threshold = max(threshold, 1)
+        """触发摘要的历史轮数阈值"""
+        self.keep = max(keep, 1)
+        """生成摘要时保留的最近原始对话轮数"""
+
+        self._summaries: LRUCache[tuple[str, str], tuple[str, int]] = LRUCache(maxsize=1024, ttl=1800)
+        """(userid, profile) -> (摘要内容, 摘要覆盖的最后一条消息 ID)"""
+        self._tasks: dict[tuple[str, str], asyncio.Task] = {}
+
+    async def _get_summary(self, session: async_scoped_session, userid: str, profile: str) -> tuple[str, int]:
+        key = (userid, profile)
+        cached = self._summaries.get(key)
+        if cached is not None:
+            return cached
+
+        summary = await SummaryORM.get_summary(session, userid, profile)
+        result = (summary.content, summary.last_msg_id) if summary else ("", 0)
+        self._summaries.set(key, result)
+        return result
+
+    async def apply(
+        self, session: async_scoped_session, model: BaseLLM, userid: str, profile: str, history: list[Message]
+    ) -> tuple[list[Message], str]:
+        """
+        以摘要代替已被覆盖的历史，并在剩余历史超过阈值时调度后台摘要任务
+
+        :param model: 用于生成摘要的模型
+        :param history: 按时间排序的对话历史
+        :return: 剩余的对话历史, 摘要内容（不存在时为空字符串）
+        """
+        content, last_msg_id = await self._get_summary(session, userid, profile)
+        if last_msg_id:
+            history = [item for item in history if item.id is None or item.id > last_msg_id]
+
+        key = (userid, profile)
+        if len(history) > self.threshold and key not in self._tasks:
+            # 尚未落库（没有 ID）的消息无法记录摘要位置，留待下次摘要
+            pending = [item for item in history[: -self.keep] if item.id is not None]
+            if pending:
+                task = asyncio.create_task(self._summarize(model, userid, profile, content, pending))
+                self._tasks[key] = task
+                task.add_done_callback(lambda task: self._discard_task(key, task))
+
+        return history, content
+
+    def _discard_task(self, key: tuple[str, str], task: asyncio.Task):
+        """
+        任务结束后移除其记录（若记录已被新任务替换则保留）
+        """
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def _summarize(self, model: BaseLLM, userid: str, profile: str, previous: str, history: list[Message]):
+        """
+        后台生成摘要：将已有摘要与新的对话合并为新摘要
+        """
+        logger.info(f"正在为用户 {userid} 生成对话摘要 ({len(history)} 轮对话)...")
+
+        dialogue = "\n".join(f"用户: {item.message}\n助手: {item.respond}" for item in history)
+        prompt = f"已有摘要:\n{previous}\n\n新的对话记录:\n{dialogue}" if previous else f"对话记录:\n{dialogue}"
+
+        try:
+            async with model.in_use():
+                response = await model.ask(ModelRequest(prompt, system=SUMMARY_SYSTEM_PROMPT), stream=False)
+        except Exception as e:
+            logger.error(f"生成对话摘要失败: {e}")
+            return
+
+        content = response.text.strip()
+        if not (response.succeed and content):
+            logger.warning(f"生成对话摘要失败: {response.text}")
+            return
+
+        last_msg_id = max(item.id for item in history if item.id is not None)
+
+        async with get_session() as session:
+            await SummaryORM.save_summary(session, userid, profile, content, last_msg_id)
+            await session.commit()
+
+        self._summaries.set((userid, profile), (content, last_msg_id))
+        logger.success(f"已更新用户 {userid} 的对话摘要")
+
+    async def reset(self, session: async_scoped_session, userid: str, profile: str):
+        """
+        删除用户指定存档的摘要，并取消正在进行的摘要任务
+        """
+        key = (userid, profile)
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+        await SummaryORM.delete_summary(session, userid, profile)
+        self._summaries.pop(key)
+
+    @staticmethod
+    def format(content: str) -> Optional[str]:
+        """
+        将摘要格式化为系统提示片段
+        """
+        return f"{SUMMARY_CONTEXT_PREFIX}{content}" if content else None
@@ -0,0 +1,129 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class LRUCache(Generic[K, V]):
+    """
+    进程内 LRU 缓存，支持可选的过期时间
+
+    只应在事件循环线程中使用（非线程安全）
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        ttl: Optional[float] = None,
+        maxbytes: int = 0,
+        sizeof: Optional[Callable[[V], int]] = None,
+        on_remove: Optional[Callable[[K, V], None]] = None,
+    ) -> None:
+        """
+        :param maxsize: 最大缓存条目数，0 表示不限制
+        :param ttl: (可选)缓存有效期（秒），为 None 时永不过期
+        :param maxbytes: 缓存值的最大总大小，0 表示不限制（需要同时提供 `sizeof`）
+        :param sizeof: (可选)计算缓存值大小的函数
+        :param on_remove: (可选)条目被淘汰、过期、覆盖或移除时的回调（`clear` 不会触发）
+        """
+        self.maxsize = maxsize
+        """最大缓存条目数"""
+        self.ttl = ttl
+        """缓存有效期（秒）"""
+        self.maxbytes = maxbytes
+        """缓存值的最大总大小"""
+        self.sizeof = sizeof
+        """计算缓存值大小的函数"""
+        self.on_remove = on_remove
+        """条目被移除时的回调"""
+        self.nbytes = 0
+        """当前缓存值的总大小"""
+        self.hits = 0
+        """命中次数"""
+        self.misses = 0
+        """未命中次数"""
+
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def _lookup(self, key: K) -> object:
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+
+        expire_at, value = item
+        if expire_at and expire_at < time.monotonic():
+            self._remove(key)
+            return _MISSING
+
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """
+        获取缓存值，未命中或已过期时返回 `default`
+        """
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value  # type: ignore[return-value]
+
+    def _size(self, value: V) -> int:
+        return self.sizeof(value) if self.sizeof else 0
+
+    def _remove(self, key: K) -> Optional[tuple[float, V]]:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.nbytes -= self._size(item[1])
+            if self.on_remove is not None:
+                self.on_remove(key, item[1])
+        return item
+
+    def set(self, key: K, value: V) -> None:
+        """
+        写入缓存值（单个值超过 `maxbytes` 时不会被缓存）
+        """
+        self._remove(key)
+
+        size = self._size(value)
+        if self.maxbytes and size > self.maxbytes:
+            return
+
+        expire_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._data[key] = (expire_at, value)
+        self.nbytes += size
+
+        while (self.maxsize and len(self._data) > self.maxsize) or (self.maxbytes and self.nbytes > self.maxbytes):
+            self._remove(next(iter(self._data)))
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """
+        移除并返回缓存值
+        """
+        item = self._remove(key)
+        return item[1] if item is not None else default
+
+    def keys(self) -> list[K]:
+        """
+        获取当前所有缓存键的快照（不检查是否过期）
+        """
+        return list(self._data)
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        self._data.clear()
+        self.nbytes = 0
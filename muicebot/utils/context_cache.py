@@ -0,0 +1,83 @@
+from dataclasses import replace
+from typing import Optional
+
+from ..models import Message
+from .cache import LRUCache
+
+ContextKey = tuple[str, ...]
+
+
+class ContextCache:
+    """
+    会话上下文缓存
+
+    保存已构建好的对话历史窗口（已校验多模态资源、已格式化群聊消息），
+    使后续对话轮次无需再查询数据库与文件系统。对话写入时追加到窗口末尾，
+    历史被修改（reset/undo/refresh/切换存档）时失效
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 1800) -> None:
+        """
+        :param maxsize: 最多缓存的会话窗口数
+        :param ttl: (可选)窗口有效期（秒），用于兜底其他途径对数据库的修改
+        """
+        self._windows: LRUCache[ContextKey, list[Message]] = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def user_key(userid: str, profile: str) -> ContextKey:
+        return ("user", userid, profile)
+
+    @staticmethod
+    def group_key(groupid: str) -> ContextKey:
+        return ("group", groupid)
+
+    def __contains__(self, key: ContextKey) -> bool:
+        return key in self._windows
+
+    def get(self, key: ContextKey) -> Optional[list[Message]]:
+        """
+        获取会话窗口的副本，未命中时返回 None
+        """
+        window = self._windows.get(key)
+        if window is None:
+            return None
+        return [replace(message) for message in window]
+
+    def set(self, key: ContextKey, messages: list[Message]):
+        """
+        缓存会话窗口
+        """
+        self._windows.set(key, [replace(message) for message in messages])
+
+    def append(self, key: ContextKey, message: Message, maxlen: int = 0):
+        """
+        向已缓存的会话窗口末尾追加一条消息（窗口未缓存时不做任何事）
+
+        :param maxlen: 窗口最大长度，0 表示不限制
+        """
+        window = self._windows.get(key)
+        if window is None:
+            return
+
+        window.append(replace(message))
+        if maxlen and len(window) > maxlen:
+            del window[:-maxlen]
+
+    def invalidate_user(self, userid: str):
+        """
+        使用户的所有会话窗口失效，同时移除包含该用户消息的群聊窗口
+        """
+        for key in self._windows.keys():
+            if key[0] == "user" and key[1] == userid:
+                self._windows.pop(key)
+                continue
+
+            window = self._windows.get(key)
+            if window is not None and any(message.userid == userid for message in window):
+                self._windows.pop(key)
+
+    def clear(self):
+        """
+        清空所有会话窗口
+        """
+        self._windows.clear()
@@ -0,0 +1,84 @@
+import asyncio
+import ssl
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
+from typing import AsyncIterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from nonebot import logger
+
+from ..config import plugin_config
+
+_ssl_context: Optional[ssl.SSLContext] = None
+_clients: dict[Optional[str], httpx.AsyncClient] = {}
+"""共享客户端: 代理地址 -> 客户端"""
+_host_semaphores: dict[str, asyncio.Semaphore] = {}
+"""每个主机的并发连接限制（仅保留有请求进行或等待中的主机）"""
+_host_users: dict[str, int] = {}
+"""每个主机进行中与等待中的请求数"""
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    global _ssl_context
+
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+        _ssl_context.set_ciphers("DEFAULT")
+    return _ssl_context
+
+
+def get_http_client(proxy: Optional[str] = None) -> httpx.AsyncClient:
+    """
+    获取进程内共享的 HTTP 客户端（保持长连接，安装 `h2` 时启用 HTTP/2）
+
+    :param proxy: (可选)代理地址，不同代理使用不同的客户端
+    """
+    client = _clients.get(proxy)
+    if client is not None and not client.is_closed:
+        return client
+
+    http2 = plugin_config.http_enable_http2 and find_spec("h2") is not None
+    limits = httpx.Limits(
+        max_connections=plugin_config.http_max_connections,
+        max_keepalive_connections=plugin_config.http_max_connections,
+        keepalive_expiry=plugin_config.http_keepalive_expiry,
+    )
+    client = httpx.AsyncClient(proxy=proxy, verify=_get_ssl_context(), http2=http2, limits=limits)
+    _clients[proxy] = client
+    return client
+
+
+@asynccontextmanager
+async def host_limit(url: str) -> AsyncIterator[None]:
+    """
+    限制对同一主机的并发请求数
+
+    主机的信号量在最后一个请求结束后移除，避免访问过的主机（如各类图片地址）无限累积
+    """
+    host = urlsplit(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(max(plugin_config.http_max_connections_per_host, 1))
+    _host_users[host] = _host_users.get(host, 0) + 1
+
+    try:
+        async with semaphore:
+            yield
+    finally:
+        _host_users[host] -= 1
+        if not _host_users[host]:
+            del _host_users[host]
+            del _host_semaphores[host]
+
+
+async def close_http_clients():
+    """
+    关闭所有共享的 HTTP 客户端
+    """
+    for client in _clients.values():
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"关闭 HTTP 客户端失败: {e}")
+    _clients.clear()
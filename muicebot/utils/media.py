@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from nonebot import logger
+from nonebot_plugin_orm import get_session
+from sqlalchemy import update
+
+from ..config import plugin_config
+from ..database.crud import MediaORM
+from ..database.orm_models import MediaBlob
+from .utils import FILES_DIR, download_file
+
+BLOBS_DIR = FILES_DIR / "blobs"
+"""内容寻址存储目录: blobs/<hash[:2]>/<hash>.<ext>"""
+
+BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_file(path: Path) -> str:
+    """
+    计算文件内容的 SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _alias_keys(url: Optional[str] = None, file_id: Optional[str] = None) -> list[str]:
+    keys = []
+    if url:
+        keys.append(f"url:{url}")
+    if file_id:
+        keys.append(f"id:{file_id}")
+    return keys
+
+
+def _move_into_store(source: Path, target: Path):
+    """
+    将文件移入存储目录；目标已存在（内容相同）时丢弃源文件
+
+    源文件可能位于其他文件系统（如挂载为独立卷的缓存目录），因此使用 `shutil.move` 而非 `os.replace`
+    """
+    if target.exists():
+        source.unlink(missing_ok=True)
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(source, target)
+
+
+async def store_file(path: str, url: Optional[str] = None, file_id: Optional[str] = None) -> str:
+    """
+    将本地文件按内容哈希移入存储目录，相同内容的文件只保留一份
+
+    :param path: 本地文件路径（文件将被移动）
+    :param url: 文件来源 URL
+    :param file_id: 适配器提供的文件 ID
+
+    :return: 存储后的文件路径
+    """
+    source = Path(path)
+    hash = await asyncio.to_thread(_hash_file, source)
+    suffix = source.suffix
+    target = (BLOBS_DIR / hash[:2] / f"{hash}{suffix}").resolve()
+
+    async with get_session() as session:
+        blob = await MediaORM.get_blob(session, hash)
+        if blob is not None and Path(blob.path).exists():
+            stored_path = blob.path
+            await asyncio.to_thread(source.unlink, missing_ok=True)
+            await MediaORM.add_aliases(session, hash, _alias_keys(url, file_id))
+            await session.commit()
+            return stored_path
+
+        size = source.stat().st_size
+        await asyncio.to_thread(_move_into_store, source, target)
+        if blob is not None:  # 记录存在但文件已丢失
+            await session.execute(update(MediaBlob).where(MediaBlob.hash == hash).values(path=str(target), size=size))
+        await MediaORM.add_blob(session, hash, str(target), size, _alias_keys(url, file_id))
+        await session.commit()
+
+    return str(target)
+
+
+async def fetch_media(
+    url: str, file_name: Optional[str] = None, file_id: Optional[str] = None, proxy: Optional[str] = None
+) -> str:
+    """
+    获取多模态文件：来源已下载过且文件仍存在时直接复用，否则下载后存入内容寻址存储
+
+    :param url: 文件在线地址
+    :param file_name: 下载时使用的临时文件名（用于确定后缀）
+    :param file_id: 适配器提供的文件 ID（同一文件的 URL 可能会变化）
+    :param proxy: 代理地址
+
+    :return: 本地文件路径
+    """
+    keys = _alias_keys(url, file_id)
+
+    async with get_session() as session:
+        blob = await MediaORM.get_blob_by_alias(session, keys)
+        if blob is not None and Path(blob.path).exists():
+            stored_path = blob.path
+            logger.debug(f"文件已存在于本地存储，跳过下载: {url}")
+            await MediaORM.add_aliases(session, blob.hash, keys)
+            # 刷新使用时间，避免在写入对话前被回收
+            await MediaORM.change_refcount(session, [stored_path], 0)
+            await session.commit()
+            return stored_path
+
+    # 下载至与存储目录同一文件系统的数据目录，入库时只需重命名
+    path = await download_file(url, file_name, proxy)
+    return await store_file(path, url, file_id)
+
+
+def _remove_files(paths: list[str]):
+    for path in paths:
+        path_ = Path(path)
+        path_.unlink(missing_ok=True)
+        # 同时移除模型预处理时生成的衍生文件
+        for variant in path_.parent.glob(f"{path_.stem}.*"):
+            variant.unlink(missing_ok=True)
+
+
+async def collect_garbage(grace_hours: int) -> int:
+    """
+    回收超过宽限期仍未被任何可用对话引用的文件
+
+    :param grace_hours: 宽限期（小时）
+
+    :return: 回收的文件数
+    """
+    before = (datetime.now() - timedelta(hours=grace_hours)).strftime("%Y.%m.%d %H:%M:%S")
+
+    async with get_session() as session:
+        blobs = await MediaORM.get_unreferenced_blobs(session, before)
+        if not blobs:
+            return 0
+        await asyncio.to_thread(_remove_files, [blob.path for blob in blobs])
+        await MediaORM.delete_blobs(session, [blob.hash for blob in blobs])
+        await session.commit()
+
+    logger.info(f"已回收 {len(blobs)} 个未被引用的多模态文件")
+    return len(blobs)
+
+
+class MediaCollector:
+    """
+    后台定期回收未被引用的多模态文件
+    """
+
+    def __init__(self, grace_hours: int, interval: float = 3600) -> None:
+        self.grace_hours = grace_hours
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await collect_garbage(self.grace_hours)
+            except Exception as e:
+                logger.error(f"回收多模态文件失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+media_collector = MediaCollector(plugin_config.media_gc_grace_hours)
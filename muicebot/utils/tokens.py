@@ -0,0 +1,42 @@
+import math
+import re
+from typing import Optional
+
+from ..models import Message, Resource
+
+_CJK_PATTERN = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+
+RESOURCE_TOKENS = {"image": 768, "audio": 512, "video": 2048, "file": 512}
+"""每个多模态资源的估算 Token 数"""
+MESSAGE_OVERHEAD = 8
+"""每轮对话（用户消息 + 模型回复）的角色标记等额外开销"""
+
+
+def estimate_text_tokens(text: Optional[str]) -> int:
+    """
+    粗略估算文本的 Token 数：CJK 字符约 1 字 1 Token，其余字符约 4 字符 1 Token
+    """
+    if not text:
+        return 0
+
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def estimate_resources_tokens(resources: list[Resource]) -> int:
+    """
+    估算多模态资源的 Token 数
+    """
+    return sum(RESOURCE_TOKENS.get(resource.type, 0) for resource in resources)
+
+
+def estimate_message_tokens(message: Message) -> int:
+    """
+    估算一轮对话（用户消息、多模态资源与模型回复）的 Token 数
+    """
+    return (
+        estimate_text_tokens(message.message)
+        + estimate_text_tokens(message.respond)
+        + estimate_resources_tokens(message.resources)
+        + MESSAGE_OVERHEAD
+    )
@@ -1,13 +1,13 @@
+import asyncio
 import base64
 import os
-import ssl
 import sys
 import time
 from importlib.metadata import PackageNotFoundError, version
 from io import BytesIO
 from mimetypes import guess_type
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 
 import fleep
 import httpx
@@ -21,6 +21,8 @@ from ..config import plugin_config
 from ..models import Resource
 from ..plugin.context import get_event
 from .adapters import ADAPTER_CLASSES
+from .cache import LRUCache
+from .http import get_http_client, host_limit
 
 FILES_DIR = store.get_plugin_data_dir() / "files"
 FILES_CACHED_DIR = store.get_plugin_cache_dir() / "files"
@@ -28,6 +30,14 @@ FILES_CACHED_DIR = store.get_plugin_cache_dir() / "files"
 FILES_DIR.mkdir(parents=True, exist_ok=True)
 FILES_CACHED_DIR.mkdir(parents=True, exist_ok=True)
 
+_username_cache: LRUCache[str, str] = LRUCache(maxsize=4096, ttl=3600)
+"""用户名缓存: userid -> username"""
+_username_failures: LRUCache[str, bool] = LRUCache(maxsize=4096, ttl=300)
+"""用户名获取失败的用户（负缓存），有效期内不再重复请求"""
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+"""流式下载时每次写入磁盘的块大小"""
+
 User_Agent = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
     "AppleWebKit/537.36 (KHTML, like Gecko)"
@@ -48,18 +58,75 @@ async def download_file(
 
     :return: 保存后的本地目录
     """
-    ssl_context = ssl.create_default_context()
-    ssl_context.set_ciphers("DEFAULT")
     file_subfix = file_url.split(".")[-1].lower() if "." in file_url else "jpg"
     file_name = file_name if file_name else f"{time.time_ns()}.{file_subfix}"
 
-    async with httpx.AsyncClient(proxy=proxy, verify=ssl_context) as client:
-        r = await client.get(file_url, headers={"User-Agent": User_Agent})
-        file_dir = FILES_CACHED_DIR if cache else FILES_DIR
-        local_path = (file_dir / file_name).resolve()
-        with open(local_path, "wb") as file:
-            file.write(r.content)
-        return str(local_path)
+    file_dir = FILES_CACHED_DIR if cache else FILES_DIR
+    local_path = (file_dir / file_name).resolve()
+    part_path = local_path.with_name(f"{local_path.name}.part")
+    max_size = plugin_config.max_download_size * 1024 * 1024
+    retries = max(plugin_config.download_retries, 0)
+    client = get_http_client(proxy)
+
+    for attempt in range(retries + 1):
+        try:
+            async with host_limit(file_url):
+                await _stream_to_file(client, file_url, part_path, max_size, resume=attempt > 0)
+            break
+
+        except httpx.TransportError as e:
+            if attempt >= retries:
+                await asyncio.to_thread(part_path.unlink, missing_ok=True)
+                raise
+            logger.warning(f"下载文件中断，正在重试 ({attempt + 1}/{retries}): {e}")
+
+        except BaseException:
+            await asyncio.to_thread(part_path.unlink, missing_ok=True)
+            raise
+
+    await asyncio.to_thread(os.replace, part_path, local_path)
+    return str(local_path)
+
+
+async def _stream_to_file(client: httpx.AsyncClient, url: str, path: Path, max_size: int = 0, resume: bool = False):
+    """
+    以流式下载文件（分块写入，磁盘 IO 在线程池中执行，不阻塞事件循环）
+
+    :param path: 保存路径
+    :param max_size: 最大文件大小（字节），0 表示不限制
+    :param resume: 是否从已下载的部分继续（服务器不支持 Range 请求时将重新下载）
+
+    :raise ValueError: 文件超出大小限制
+    :raise httpx.HTTPStatusError: 服务器返回错误状态码
+    """
+    offset = 0
+    if resume and await asyncio.to_thread(path.exists):
+        offset = (await asyncio.to_thread(path.stat)).st_size
+
+    headers = {"User-Agent": User_Agent}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    async with client.stream("GET", url, headers=headers) as r:
+        r.raise_for_status()
+
+        if r.status_code != 206:
+            offset = 0
+
+        content_length = r.headers.get("Content-Length")
+        if max_size and content_length and content_length.isdigit() and offset + int(content_length) > max_size:
+            raise ValueError(f"文件大小超出限制 ({plugin_config.max_download_size} MB): {url}")
+
+        file = await asyncio.to_thread(open, path, "ab" if offset else "wb")
+        try:
+            written = offset
+            async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if max_size and written > max_size:
+                    raise ValueError(f"文件大小超出限制 ({plugin_config.max_download_size} MB): {url}")
+                await asyncio.to_thread(file.write, chunk)
+        finally:
+            await asyncio.to_thread(file.close)
 
 
 async def save_image_as_base64(image_url: str, proxy: Optional[str] = None) -> str:
@@ -69,12 +136,10 @@ async def save_image_as_base64(image_url: str, proxy: Optional[str] = None) -> s
     :image_url: 图片在线地址
     :return: 本地地址
     """
-    ssl_context = ssl.create_default_context()
-    ssl_context.set_ciphers("DEFAULT")
+    async with host_limit(image_url):
+        r = await get_http_client(proxy).get(image_url, headers={"User-Agent": User_Agent})
 
-    async with httpx.AsyncClient(proxy=proxy, verify=ssl_context) as client:
-        r = await client.get(image_url, headers={"User-Agent": User_Agent})
-        image_base64 = base64.b64encode(r.content)
+    image_base64 = base64.b64encode(r.content)
     return image_base64.decode("utf-8")
 
 
@@ -197,6 +262,59 @@ def get_version() -> str:
         return "Unknown"
 
 
+def prewarm_usernames(usernames: dict[str, str]):
+    """
+    使用已知的用户名（如数据库中的 `User.nickname`）预热用户名缓存，不会覆盖已缓存的用户名
+
+    :param usernames: userid -> username
+    """
+    for user_id, username in usernames.items():
+        if user_id not in _username_cache:
+            _username_cache.set(user_id, username)
+
+
+async def get_usernames(user_ids: Iterable[str], event: Optional[Event] = None) -> dict[str, str]:
+    """
+    批量获取用户名，未缓存的用户将并发请求，获取失败时以用户id代替
+
+    :param user_ids: 用户ID列表
+    :param event: Nonebot 事件对象，如果空则从 Muicebot 上下文中获取
+    （注意：存在未缓存的用户时，必须保证是在 Muice 事件处理流程[即普通对话事件]中才可为空）
+    :return: userid -> username
+    """
+    usernames: dict[str, str] = {}
+    missing: list[str] = []
+
+    for user_id in dict.fromkeys(user_ids):
+        username = _username_cache.get(user_id)
+        if username is not None:
+            usernames[user_id] = username
+        elif user_id in _username_failures:
+            usernames[user_id] = user_id
+        else:
+            missing.append(user_id)
+
+    if not missing:
+        return usernames
+
+    bot = get_bot()
+    event = event or get_event()
+    results = await asyncio.gather(*(get_user_info(bot, event, user_id) for user_id in missing), return_exceptions=True)
+
+    for user_id, user_info in zip(missing, results):
+        if isinstance(user_info, BaseException) or user_info is None:
+            if isinstance(user_info, BaseException):
+                logger.warning(f"获取用户 {user_id} 的用户名失败: {user_info}")
+            _username_failures.set(user_id, True)
+            usernames[user_id] = user_id
+            continue
+
+        _username_cache.set(user_id, user_info.user_name)
+        usernames[user_id] = user_info.user_name
+
+    return usernames
+
+
 async def get_username(user_id: Optional[str] = None, event: Optional[Event] = None) -> str:
     """
     获取当前对话的用户名，如果失败就返回用户id
@@ -205,11 +323,11 @@ async def get_username(user_id: Optional[str] = None, event: Optional[Event] = N
     :param event: Nonebot 事件对象，如果空则从 Muicebot 上下文中获取
     （注意：必须保证是在 Muice 事件处理流程[即普通对话事件]中才可为空）
     """
-    bot = get_bot()
-    event = event or get_event()
-    user_id = user_id if user_id else event.get_user_id()
-    user_info = await get_user_info(bot, event, user_id)
-    return user_info.user_name if user_info else user_id
+    if not user_id:
+        event = event or get_event()
+        user_id = event.get_user_id()
+
+    return (await get_usernames([user_id], event))[user_id]
 
 
 def guess_mimetype(resource: Resource) -> Optional[str]: